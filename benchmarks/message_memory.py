@@ -0,0 +1,68 @@
+"""
+比较不同模式下每条群消息占用的内存：
+    python benchmarks/message_memory.py [消息数量]
+"""
+
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import miraicle
+
+
+def make_raw(i: int) -> dict:
+    return {'type': 'GroupMessage',
+            'sender': {'id': 10000 + i % 500,
+                       'memberName': f'member{i % 500}',
+                       'specialTitle': '',
+                       'permission': 'MEMBER',
+                       'joinTimestamp': 1600000000,
+                       'lastSpeakTimestamp': 1600000000 + i,
+                       'muteTimeRemaining': 0,
+                       'group': {'id': 20000 + i % 20,
+                                 'name': f'group{i % 20}',
+                                 'permission': 'MEMBER'}},
+            'messageChain': [{'type': 'Source', 'id': i, 'time': 1600000000 + i},
+                             {'type': 'At', 'target': 123456789, 'display': '@bot'},
+                             {'type': 'Plain', 'text': f' hello world #{i}'},
+                             {'type': 'Image', 'imageId': '{01E9451B-70ED-EAE3-B37C-101F1EEBF5B5}.jpg',
+                              'url': 'https://example.com/image.jpg', 'path': None}]}
+
+
+def measure(count: int, compact: bool, decode: bool) -> float:
+    """返回保留 count 条消息时每条消息占用的字节数"""
+    miraicle.Message.compact = compact
+    payloads = [json.dumps(make_raw(i)) for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    messages = []
+    for payload in payloads:
+        msg = miraicle.GroupMessage(json.loads(payload), 123456789)
+        if decode:
+            msg.chain
+        messages.append(msg)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return size / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f'{count} GroupMessage objects, compact=False -> compact=True')
+    for decode in (False, True):
+        full = measure(count, False, decode)
+        compact = measure(count, True, decode)
+        print(f'decoded={decode!s:<5} {full:8.0f} -> {compact:8.0f} bytes/message '
+              f'({1 - compact / full:.0%} saved)')
+    miraicle.Message.compact = False
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+用本地的替身服务器测试流式上传，比较上传前后的峰值内存与事件循环的响应：
+    python benchmarks/upload_stream.py [文件大小 MB]
+"""
+
+import asyncio
+import hashlib
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import miraicle
+
+PORT = 18765
+
+
+async def handle_upload(request: web.Request) -> web.Response:
+    """替身服务器：读取 multipart 请求，返回文件大小与 sha256"""
+    reader = await request.multipart()
+    digest = hashlib.sha256()
+    size = 0
+    async for part in reader:
+        if part.filename:
+            while True:
+                chunk = await part.read_chunk(1 << 20)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+        else:
+            await part.text()
+    return web.json_response({'code': 0, 'size': size, 'sha256': digest.hexdigest()})
+
+
+def serve():
+    loop = asyncio.new_event_loop()
+    app = web.Application(client_max_size=1 << 40)
+    app.router.add_post('/uploadFileAndSend', handle_upload)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', PORT).start())
+    loop.run_forever()
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_file(size_mb: int) -> str:
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    with os.fdopen(fd, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1 << 20))
+    return path
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    threading.Thread(target=serve, daemon=True).start()
+    time.sleep(0.5)
+    path = make_file(size_mb)
+    try:
+        rss = max_rss_mb()
+        bot = miraicle.Mirai(qq=1, verify_key='', port=PORT)
+        started = time.perf_counter()
+        response = bot.upload_file_and_send('/benchmark.bin', 1, path)
+        print(f'Mirai      {response["size"] >> 20} MB in {time.perf_counter() - started:.2f}s, '
+              f'peak RSS +{max_rss_mb() - rss:.0f} MB')
+
+        async def upload_async():
+            bot = miraicle.AsyncMirai(qq=1, verify_key='', port=PORT)
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.ensure_future(tick())
+            started = time.perf_counter()
+            response = await bot.upload_file_and_send('/benchmark.bin', 1, path)
+            elapsed = time.perf_counter() - started
+            ticker.cancel()
+            await bot.close()
+            print(f'AsyncMirai {response["size"] >> 20} MB in {elapsed:.2f}s, '
+                  f'event loop ticked {ticks} times (ideal {elapsed / 0.01:.0f})')
+
+        asyncio.get_event_loop().run_until_complete(upload_async())
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
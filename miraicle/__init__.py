@@ -1,5 +1,6 @@
 from .mirai import Mirai
 from .asyncmirai import AsyncMirai
 from .message import *
+from .events import *
 from .filters import *
 from .schedule import Scheduler, scheduled_job
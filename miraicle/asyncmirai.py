@@ -1,16 +1,24 @@
 import aiohttp
 import asyncio
 import json
-from io import BytesIO
-from typing import Dict
+from typing import Dict, Set
 
 from .utils import *
 from .message import *
+from .events import *
 from .schedule import Scheduler
+from .multiplexer import AsyncMultiplexer
+from .supervisor import TaskSupervisor
+from .ratelimit import SendLimiter, AsyncSendQueue
+from .cache import MemberCache, ContactDirectory
+from .media import MediaCache
+from .history import MessageStore
+from .upload import AsyncMultipartStream, Progress
 
 
 class AsyncMirai(metaclass=Singleton):
     receiver_funcs = {}
+    receiver_keys = {}
     filter_funcs = {}
     __filters = []
 
@@ -19,51 +27,120 @@ class AsyncMirai(metaclass=Singleton):
                  verify_key: str,
                  port: int,
                  session_key: Optional[str] = None,
-                 adapter: str = 'http'):
+                 adapter: str = 'http',
+                 fetch_count: int = 100,
+                 poll_interval: float = 0.5):
         """创建一个 AsyncMirai 对象
         :param qq: 要绑定的 bot 的 qq 号
         :param verify_key: 创建 mirai-http-server 时生成的 key, 在 mirai-api-http 的 setting 文件中手动指定
         :param port: 端口号，在 mirai-api-http 的 setting 文件中手动指定
         :param session_key: 经过校验得到的 session 号，可选
         :param adapter: 连接方式，支持 http 和 ws，默认为 http
+        :param fetch_count: http adapter 每次拉取消息的数量上限，默认为 100
+        :param poll_interval: http adapter 消息队列为空时轮询间隔的上限，单位为秒，默认为 0.5
         """
         self.qq: int = qq
         self.verify_key: str = verify_key
         self.base_url: str = f'{adapter}://localhost:{port}'
         self.session_key: Optional[str] = session_key
         self.adapter: str = adapter
+        self.fetch_count: int = fetch_count
+        self.poll_interval: float = poll_interval
 
         self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.request_timeout: float = 30.
+        self.max_in_flight: int = 64
+        self.event_queue_size: int = 1024
+        self.event_overflow: str = 'drop_oldest'
+        self.dropped_events: int = 0
+        self.supervisor: TaskSupervisor = TaskSupervisor()
+        self.send_queue: Optional[AsyncSendQueue] = None
+        self.member_cache: MemberCache = MemberCache(qq)
+        self.contacts: ContactDirectory = ContactDirectory()
+        self.message_store: MessageStore = MessageStore(qq)
+        self.media_cache: Optional[MediaCache] = None
+        self.max_uploads: int = 4
+
+        self.connector_options: Dict = {'limit': 100, 'limit_per_host': 32,
+                                        'keepalive_timeout': 30., 'ttl_dns_cache': 300}
+
+        self.__client: Optional[aiohttp.ClientSession] = None
+        self.__client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__upload_slots: Optional[asyncio.Semaphore] = None
         self.__session: Optional[Union[aiohttp.ClientSession, aiohttp.ClientWebSocketResponse]] = None
-        self.__msg_pool: Dict[str, json] = {}
+        self.__mux: Optional[AsyncMultiplexer] = None
+        self.__events: Optional[asyncio.Queue] = None
+        self.__dispatcher: Optional[asyncio.Task] = None
+        self.__background: Set[asyncio.Task] = set()
         self.__scheduler: Scheduler = Scheduler()
 
+    def __client_session(self) -> aiohttp.ClientSession:
+        """返回 bot 持有的 ClientSession，所有请求共用它的连接池与 DNS 缓存；
+        连接池的参数由 connector_options 指定，会传给 aiohttp.TCPConnector；
+        ClientSession 属于创建它的事件循环，换用事件循环前应先 await close()，否则在这里关闭旧的 ClientSession"""
+        loop = asyncio.get_event_loop()
+        if self.__client is not None and not self.__client.closed and self.__client_loop is not loop:
+            self.__discard_client(self.__client, self.__client_loop)
+        if self.__client is None or self.__client.closed or self.__client_loop is not loop:
+            self.__client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(**self.connector_options))
+            self.__client_loop = loop
+        return self.__client
+
+    @staticmethod
+    def __discard_client(client: aiohttp.ClientSession, loop: asyncio.AbstractEventLoop):
+        """关闭属于另一个事件循环的 ClientSession：该循环未关闭时把关闭交给它执行；
+        已经关闭时连接无法再正常关闭，只将 session 与连接池分离"""
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            client.detach()
+
+    async def close(self):
+        """取消分发、定时与后台任务以及 supervisor 中的任务并等待它们结束，再关闭 websocket 连接与 ClientSession"""
+        tasks = list(self.__background)
+        if self.__dispatcher is not None:
+            tasks.append(self.__dispatcher)
+            self.__dispatcher = None
+        await cancel_tasks(tasks)
+        await self.supervisor.cancel()
+        if self.send_queue is not None:
+            await self.send_queue.close()
+        if isinstance(self.__session, aiohttp.ClientWebSocketResponse) and not self.__session.closed:
+            await self.__session.close()
+        self.__session = None
+        if self.__client is not None and not self.__client.closed:
+            await self.__client.close()
+        self.__client = None
+
     async def version(self):
         """获取 mirai-api-http 的版本号"""
-        async with aiohttp.ClientSession().get(url=f'{self.base_url}/about') as r:
+        async with self.__client_session().get(url=f'{self.base_url}/about') as r:
             response = await r.json()
         if 'data' in response and 'version' in response['data']:
             return response['data']['version']
 
     async def get_version(self):
         warnings.warn('get_version 方法已弃用，请使用 version 代替', DeprecationWarning)
-        async with aiohttp.ClientSession().get(url=f'{self.base_url}/about') as r:
+        async with self.__client_session().get(url=f'{self.base_url}/about') as r:
             response = await r.json()
         if 'data' in response and 'version' in response['data']:
             return response['data']['version']
 
     def run(self):
-        """开始运行"""
-        if self.adapter == 'http':
-            self.__loop = asyncio.get_event_loop()
-            self.__loop.run_until_complete(self.__http_run())
-        elif self.adapter == 'ws':
-            self.__loop = asyncio.get_event_loop()
-            self.__loop.run_until_complete(self.__ws_run())
+        """开始运行，结束时关闭所有连接"""
+        ensure_logging()
+        self.__loop = asyncio.get_event_loop()
+        try:
+            if self.adapter == 'http':
+                self.__loop.run_until_complete(self.__http_run())
+            elif self.adapter == 'ws':
+                self.__loop.run_until_complete(self.__ws_run())
+        finally:
+            self.__loop.run_until_complete(self.close())
 
     async def __http_run(self):
         """使用 http adapter 运行"""
-        self.__session = aiohttp.ClientSession()
+        self.__session = self.__client_session()
         if not self.session_key:
             verify_response = await self.__http_verify()
             if all(
@@ -71,7 +148,7 @@ class AsyncMirai(metaclass=Singleton):
                      'session' in verify_response and verify_response['session']]
             ):
                 self.session_key = verify_response['session']
-                print(f"sessionKey: {verify_response['session']}")
+                logger.info('sessionKey: %s', verify_response['session'])
                 verify_response = await self.__http_bind()
                 if all(
                         ['code' in verify_response and verify_response['code'] == 0,
@@ -87,10 +164,12 @@ class AsyncMirai(metaclass=Singleton):
 
     async def __ws_run(self):
         """使用 ws adapter 运行"""
-        async with aiohttp.ClientSession().ws_connect(f'{self.base_url}/all',
+        async with self.__client_session().ws_connect(f'{self.base_url}/all',
                                                       headers={'verifyKey': self.verify_key,
                                                                'qq': str(self.qq)}) as ws:
             self.__session = ws
+            self.__mux = AsyncMultiplexer(ws.send_str, timeout=self.request_timeout,
+                                          max_in_flight=self.max_in_flight)
             connect_response = await ws.receive()
             connect_data = (json.loads(connect_response.data).get('data', {}))
             if all(
@@ -98,7 +177,7 @@ class AsyncMirai(metaclass=Singleton):
                      'session' in connect_data and connect_data['session']]
             ):
                 self.session_key = connect_data['session']
-                print(f"sessionKey: {connect_data['session']}")
+                logger.info('sessionKey: %s', connect_data['session'])
             else:
                 if 'code' in connect_data and connect_data['code'] == 1:
                     raise ValueError('invalid verifyKey')
@@ -133,36 +212,31 @@ class AsyncMirai(metaclass=Singleton):
         return response
 
     async def __ws_send(self, command: str, subcommand: str = None, content: json = None):
-        """websocket 发送数据"""
-        sync_id = str(random.randint(0, 100_000_000))
-        await self.__session.send_str(
-            json.dumps({'syncId': sync_id,
-                        'command': command,
-                        'subCommand': subcommand,
-                        'content': content}))
-        future = self.__loop.create_future()
-        self.__msg_pool[sync_id] = future
-        result = await future
-        return result
+        """websocket 发送数据并等待响应"""
+        return await self.__mux.request(command, subcommand, content)
 
     @start_log
     async def __http_main_loop(self):
         """http 主循环"""
+        self.__start_background(self.__call_schedule_plugins())
+        self.__start_background(self.__refresh_contacts())
+        interval = 0.
         while True:
-            await asyncio.sleep(0.5)
-            await self.__scheduler.async_run(self)
+            await asyncio.sleep(interval)
             try:
-                msg_json = await self.__http_fetch_msg(10)
+                msg_json = await self.__http_fetch_msg(self.fetch_count)
                 msg_data = msg_json['data']
                 for msg_origin in msg_data:
                     msg_type = msg_origin.get('type', None)
                     msg = self.__handle_msg_origin(msg_origin, msg_type)
-                    print(msg)
+                    logger.info('%s', msg)
                     funcs = self.receiver_funcs.get(msg_type, [])
                     if funcs:
                         await self.__call_plugins(funcs, msg)
             except:
+                interval = self.poll_interval
                 continue
+            interval = next_poll_interval(interval, len(msg_data), self.fetch_count, self.poll_interval)
 
     async def __http_fetch_msg(self, count):
         """http 接收消息"""
@@ -172,78 +246,190 @@ class AsyncMirai(metaclass=Singleton):
             response = await r.json()
         return response
 
+    @property
+    def event_queue_depth(self) -> int:
+        """ws adapter 中等待解析与分发的事件数量"""
+        return self.__events.qsize() if self.__events else 0
+
     @start_log
     async def __ws_main_loop(self):
-        """ws 主循环"""
-        self.__loop.create_task(self.__call_schedule_plugins())
+        """ws 主循环，只负责接收数据：响应直接交给等待中的请求，事件放入队列由分发任务处理，
+        处理函数的并发达到上限时只有分发任务等待，接收与响应不受影响"""
+        self.__start_background(self.__call_schedule_plugins())
+        self.__start_background(self.__refresh_contacts())
+        self.__events = asyncio.Queue(self.event_queue_size)
+        self.__dispatcher = self.__loop.create_task(self.__ws_dispatch_loop())
         while True:
             response = await self.__session.receive()
+            if response.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                error = ConnectionError(f'websocket 连接已断开: {response.type.name}')
+                self.__mux.fail_all(error)
+                raise error
             try:
                 msg_json = json.loads(response.data)
                 if msg_json['syncId'] == '-1':
-                    msg_origin = msg_json['data']
-                    msg_type = msg_origin['type']
-                    msg = self.__handle_msg_origin(msg_origin, msg_type)
-                    print(msg)
-                    funcs = self.receiver_funcs.get(msg_type, [])
-                    if funcs:
-                        await self.__call_plugins(funcs, msg)
+                    await self.__put_event(msg_json['data'])
                 else:
-                    response = msg_json['data']
-                    sync_id = msg_json['syncId']
-                    if sync_id in self.__msg_pool:
-                        future: asyncio.Future = self.__msg_pool.pop(sync_id)
-                        future.set_result(response)
-                    else:
-                        print(color('Exception: 没有找到对应的 sync_id', 'violet'))
+                    if not self.__mux.resolve(msg_json['syncId'], msg_json['data']):
+                        logger.warning('Exception: 没有找到对应的 sync_id', extra={'color': 'violet'})
             except:
                 pass
 
+    async def __put_event(self, msg_origin):
+        """按 event_overflow 的策略将事件放入队列：
+        'block' 等待队列空出位置，'drop_oldest' 丢弃最早的事件，'drop_newest' 丢弃新的事件；
+        'block' 等待时接收也会暂停，处理函数等待的 API 响应同样读不到，因此默认丢弃最早的事件并记录警告"""
+        if self.event_overflow == 'block':
+            await self.__events.put(msg_origin)
+            return
+        while True:
+            try:
+                self.__events.put_nowait(msg_origin)
+                return
+            except asyncio.QueueFull:
+                self.dropped_events += 1
+                logger.warning('事件队列已满，丢弃一个事件，共丢弃 %d 个', self.dropped_events)
+                if self.event_overflow == 'drop_newest':
+                    return
+                try:
+                    self.__events.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+
+    async def __ws_dispatch_loop(self):
+        """ws 分发任务，解析事件并交给 supervisor 处理"""
+        while True:
+            msg_origin = await self.__events.get()
+            try:
+                msg_type = msg_origin['type']
+                msg = self.__handle_msg_origin(msg_origin, msg_type)
+                logger.info('%s', msg)
+                funcs = self.receiver_funcs.get(msg_type, [])
+                if funcs:
+                    await self.__call_plugins(funcs, msg)
+            except Exception:
+                pass
+
     async def __call_plugins(self, funcs, msg):
         for flt in self.__filters:
             funcs = flt.sift(funcs, self, msg)
-        tasks = [flt.async_call(self, msg) for flt in self.__filters] + \
-                [func(self, msg) for func in funcs]
-        for task in tasks:
-            self.__loop.create_task(task)
+        for flt in self.__filters:
+            await self.supervisor.submit(flt.async_call, self, msg)
+        for func in funcs:
+            key = resolve_key(self.receiver_keys.get(func, None), msg)
+            if key is None:
+                await self.supervisor.submit(func, self, msg)
+            else:
+                await self.supervisor.submit_ordered(key, func, self, msg)
 
-    async def __call_schedule_plugins(self):
+    def __start_background(self, coro):
+        """创建后台任务并保留引用，避免任务在运行中被回收"""
+        task = self.__loop.create_task(coro)
+        self.__background.add(task)
+        task.add_done_callback(self.__background.discard)
+
+    async def __refresh_contacts(self):
+        """加载好友与群列表，之后按 contacts.refresh_interval 定期重新加载"""
         while True:
-            await asyncio.sleep(0.5)
-            await self.__scheduler.async_run(self)
+            try:
+                await self.friend_list()
+                await self.group_list()
+            except Exception as e:
+                logger.error('刷新好友与群列表失败: %s: %s', e.__class__.__name__, e)
+            if not self.contacts.refresh_interval:
+                return
+            await asyncio.sleep(self.contacts.refresh_interval)
+
+    async def __call_schedule_plugins(self):
+        await self.__scheduler.async_run_forever(self)
 
     def __handle_msg_origin(self, msg_origin, msg_type):
-        if msg_type in ['GroupMessage', 'FriendMessage', 'TempMessage']:
-            msg = eval(msg_type)(msg_origin, self.qq)
-        elif msg_type in ['GroupRecallEvent', 'MemberCardChangeEvent']:
-            msg = eval(msg_type)(msg_origin)
-        elif msg_type in ['BotOnlineEvent', 'BotReloginEvent']:
-            msg = BotOnlineEvent(msg_origin)
-        elif msg_type in ['BotOfflineEventActive', 'BotOfflineEventForce', 'BotOfflineEventDropped']:
-            msg = BotOfflineEvent(msg_origin)
+        msg = parse_event(msg_origin, self.qq)
+        self.member_cache.observe(msg)
+        self.contacts.observe(msg)
+        if isinstance(msg, Message):
+            self.message_store.add(msg)
+        elif isinstance(msg, GroupRecallEvent):
+            msg.message = self.message_store.get(msg.id, msg.group)
+        elif isinstance(msg, FriendRecallEvent):
+            msg.message = self.message_store.get(msg.id)
+        return msg
+
+    def set_send_limit(self, rate: float = 1., burst: float = 3, global_rate: float = 10.,
+                       global_burst: float = 10, coalesce: float = 0.):
+        """限制发送消息的速率：消息先进入发送队列，按目标与全局的令牌桶轮流发送，
+        发送失败时自动降低速率；send_* 方法仍会等待并返回 mirai-api-http 的响应
+        :param rate: 每个群或好友每秒发送的消息数量
+        :param burst: 每个群或好友允许连续发送的消息数量
+        :param global_rate: 全局每秒发送的消息数量
+        :param global_burst: 全局允许连续发送的消息数量
+        :param coalesce: 合并窗口，单位为秒；同一目标在窗口内排队的消息合并为一次调用发送，
+            每个调用者都会得到合并后消息的 messageId，只有第一条消息可以引用回复，默认不合并
+        """
+        limiter = SendLimiter(rate, burst, global_rate, global_burst, coalesce=coalesce)
+        self.send_queue = AsyncSendQueue(self.__post_msg, limiter)
+
+    async def __send_msg(self, target, command: str, content: dict):
+        """发送消息，设置了发送速率限制时经由发送队列发送"""
+        if self.send_queue is not None:
+            return await self.send_queue.send(target, command, content)
+        return await self.__post_msg(command, content)
+
+    async def __post_msg(self, command: str, content: dict):
+        if self.adapter == 'http':
+            async with self.__session.post(url=f'{self.base_url}/{command}', json=content) as r:
+                return await r.json()
         else:
-            msg = msg_origin
+            assert self.adapter == 'ws'
+            return await self.__ws_send(command=command, content=content)
+
+    async def __apply_media_cache(self, msg, type: str):
+        """将消息中的本地图片与语音替换为 media_cache 中的 id；http adapter 下未命中时先上传再记录 id
+        :param type: 上传时使用的类型，'friend'、'group' 或 'temp'
+        """
+        if self.media_cache is None:
+            return msg
+        if isinstance(msg, (list, tuple)):
+            return [await self.__cached_media(ele, type) for ele in msg]
+        elif isinstance(msg, Element):
+            return await self.__cached_media(msg, type)
         return msg
 
+    async def __cached_media(self, ele, type: str):
+        key = self.media_cache.key(ele, type)
+        if key is None:
+            return ele
+        media_id = self.media_cache.get(key)
+        if media_id is None and self.adapter == 'http':
+            endpoint, name, id_key = ('uploadImage', 'img', 'imageId') if key[0] == 'Image' \
+                else ('uploadVoice', 'voice', 'voiceId')
+            try:
+                response = await self.__upload(endpoint, {'sessionKey': self.session_key, 'type': type},
+                                               name, self.media_cache.source(ele), None)
+            except Exception as e:
+                logger.error('上传 %s 失败: %s: %s', key[0], e.__class__.__name__, e)
+                return ele
+            media_id = response.get(id_key, None)
+            if media_id:
+                self.media_cache.put(key, media_id)
+        return self.media_cache.replace(ele, media_id) if media_id else ele
+
     async def send_friend_msg(self, qq: int, msg):
         """发送好友消息
         :param qq: 发送消息目标好友的 QQ 号
         :param msg: 发送的消息
         :return: mirai-api-http 的响应
         """
+        msg = await self.__apply_media_cache(msg, 'friend')
         msg_chain = self.__handle_friend_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'qq': qq,
                    'messageChain': msg_chain}
-        if self.adapter == 'http':
-            async with self.__session.post(url=f'{self.base_url}/sendFriendMessage', json=content) as r:
-                response = await r.json()
-        else:
-            assert self.adapter == 'ws'
-            response = await self.__ws_send(command='sendFriendMessage', content=content)
+        response = await self.__send_msg(('friend', qq), 'sendFriendMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'FriendMessage', msg_id, qq)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     async def send_temp_msg(self, group: int, qq: int, msg):
@@ -253,20 +439,17 @@ class AsyncMirai(metaclass=Singleton):
         :param msg: 发送的消息
         :return: mirai-api-http 的响应
         """
+        msg = await self.__apply_media_cache(msg, 'temp')
         msg_chain = self.__handle_friend_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'qq': qq,
                    'group': group,
                    'messageChain': msg_chain}
-        if self.adapter == 'http':
-            async with self.__session.post(url=f'{self.base_url}/sendTempMessage', json=content) as r:
-                response = await r.json()
-        else:
-            assert self.adapter == 'ws'
-            response = await self.__ws_send(command='sendTempMessage', content=content)
+        response = await self.__send_msg(('temp', group, qq), 'sendTempMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'TempMessage', msg_id, group)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     @staticmethod
@@ -291,6 +474,7 @@ class AsyncMirai(metaclass=Singleton):
         :param quote: 引用一条消息的 messageId 进行回复
         :return: mirai-api-http 的响应
         """
+        msg = await self.__apply_media_cache(msg, 'group')
         msg_chain = self.__handle_group_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'group': group,
@@ -298,15 +482,11 @@ class AsyncMirai(metaclass=Singleton):
         if quote:
             content['quote'] = quote
 
-        if self.adapter == 'http':
-            async with self.__session.post(url=f'{self.base_url}/sendGroupMessage', json=content) as r:
-                response = await r.json()
-        else:
-            assert self.adapter == 'ws'
-            response = await self.__ws_send(command='sendGroupMessage', content=content)
+        response = await self.__send_msg(('group', group), 'sendGroupMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'GroupMessage', msg_id, group)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     @staticmethod
@@ -345,15 +525,18 @@ class AsyncMirai(metaclass=Singleton):
             return response
 
     async def friend_list(self):
-        """获取好友列表"""
+        """获取好友列表，同时刷新 contacts"""
         content = {'sessionKey': self.session_key}
+        since = self.contacts.mark()
+        response = None
         if self.adapter == 'http':
             async with self.__session.get(url=f'{self.base_url}/friendList', params=content) as r:
                 response = await r.json()
-            return response
         elif self.adapter == 'ws':
             response = await self.__ws_send(command='friendList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.contacts.load_friends(response['data'], since)
+        return response
 
     async def get_friend_list(self):
         warnings.warn('get_friend_list 方法已弃用，请使用 friend_list 代替', DeprecationWarning)
@@ -367,15 +550,18 @@ class AsyncMirai(metaclass=Singleton):
             return response
 
     async def group_list(self):
-        """获取群列表"""
+        """获取群列表，同时刷新 contacts"""
         content = {'sessionKey': self.session_key}
+        since = self.contacts.mark()
+        response = None
         if self.adapter == 'http':
             async with self.__session.get(url=f'{self.base_url}/groupList', params=content) as r:
                 response = await r.json()
-            return response
         elif self.adapter == 'ws':
             response = await self.__ws_send(command='groupList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.contacts.load_groups(response['data'], since)
+        return response
 
     async def get_group_list(self):
         warnings.warn('get_group_list 方法已弃用，请使用 group_list 代替', DeprecationWarning)
@@ -392,13 +578,15 @@ class AsyncMirai(metaclass=Singleton):
         """获取群成员列表"""
         content = {'sessionKey': self.session_key,
                    'target': group}
+        response = None
         if self.adapter == 'http':
             async with self.__session.get(url=f'{self.base_url}/memberList', params=content) as r:
                 response = await r.json()
-            return response
         elif self.adapter == 'ws':
             response = await self.__ws_send(command='memberList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.member_cache.load(group, response['data'])
+        return response
 
     async def get_member_list(self, group):
         warnings.warn('get_member_list 方法已弃用，请使用 member_list 代替', DeprecationWarning)
@@ -470,47 +658,48 @@ class AsyncMirai(metaclass=Singleton):
             response = await self.__ws_send(command='sessionInfo', content=content)
             return response
 
-    async def upload_img(self, img: Image, type='group'):
+    async def upload_img(self, img: Image, type='group', progress: Optional[Progress] = None):
         """图片文件上传，当前仅支持 http
         :param img: 上传的 Image 对象
         :param type: 'friend' 或 'group' 或 'temp'
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         :return: 图片的 imageId, url 和 path
         """
-        async with self.__session.post(url=f'{self.base_url}/uploadImage',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type},
-                                       files={'img': BytesIO(open(img.path, 'rb').read())}) as r:
-            response = await r.json()
-        return response
+        return await self.__upload('uploadImage', {'sessionKey': self.session_key, 'type': type},
+                                   'img', img.path, progress)
 
-    async def upload_voice(self, voice: Voice, type='group'):
+    async def upload_voice(self, voice: Voice, type='group', progress: Optional[Progress] = None):
         """语音文件上传，当前仅支持 http
         :param voice: 上传的 Voice 对象
         :param type: 当前仅支持 'group'
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         :return: 语音的 voiceId, url 和 path
         """
-        async with self.__session.post(url=f'{self.base_url}/uploadVoice',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type},
-                                       files={'voice': BytesIO(open(voice.path, 'rb').read())}) as r:
-            response = await r.json()
-        return response
+        return await self.__upload('uploadVoice', {'sessionKey': self.session_key, 'type': type},
+                                   'voice', voice.path, progress)
 
-    async def upload_file_and_send(self, path: str, group: int, file, type='Group'):
+    async def upload_file_and_send(self, path: str, group: int, file, type='Group',
+                                   progress: Optional[Progress] = None):
         """文件上传，当前仅支持 http
         :param path: 文件上传目录与名字
         :param group: 指定群的群号
-        :param file: 文件内容
+        :param file: 文件路径或以二进制模式打开的文件对象
         :param type: 当前仅支持 "Group"
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         """
-        async with self.__session.post(url=f'{self.base_url}/uploadFileAndSend',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type,
-                                             'target': group,
-                                             'path': path},
-                                       files={'file': BytesIO(open(file, 'rb').read())}) as r:
-            response = await r.json()
-        return response
+        return await self.__upload('uploadFileAndSend', {'sessionKey': self.session_key, 'type': type,
+                                                         'target': group, 'path': path},
+                                   'file', file, progress)
+
+    async def __upload(self, endpoint: str, fields: dict, name: str, source, progress: Optional[Progress]):
+        """以流的方式上传文件，文件在线程池中读取；同时进行的上传数量不超过 max_uploads"""
+        if self.__upload_slots is None:
+            self.__upload_slots = asyncio.Semaphore(self.max_uploads)
+        async with self.__upload_slots:
+            async with AsyncMultipartStream(fields, name, source, progress=progress) as body:
+                async with self.__client_session().post(url=f'{self.base_url}/{endpoint}',
+                                                        data=body.__aiter__(), headers=body.headers) as r:
+                    return await r.json()
 
     async def delete_friend(self, qq: int):
         """删除好友
@@ -704,50 +893,41 @@ class AsyncMirai(metaclass=Singleton):
             return response
 
     async def is_owner(self, qq: int, group: int):
-        """判断某成员在指定群内是否为群主
+        """判断某成员在指定群内是否为群主，群成员列表会被缓存
         :param qq: 指定群员 QQ 号
         :param group: 指定群的群号
         :return: 成员在指定群内是否为群主
         """
-        member_list = (await self.member_list(group))['data']
-        if qq == self.qq:
-            return member_list[0].get('group', {}).get('permission', None) == 'OWNER'
-        for member in member_list:
-            member_qq = member.get('id', None)
-            member_permission = member.get('permission', None)
-            if member_qq == qq:
-                if member_permission == 'OWNER':
-                    return True
-                else:
-                    return False
-        return False
+        return await self.__member_permission(qq, group) == 'OWNER'
 
     async def is_administrator(self, qq: int, group: int):
-        """判断某成员在指定群内是否为管理员
+        """判断某成员在指定群内是否为管理员，群成员列表会被缓存
         :param qq: 指定群员 QQ 号
         :param group: 指定群的群号
         :return: 成员在指定群内是否为管理员
         """
-        member_list = (await self.member_list(group))['data']
-        if qq == self.qq:
-            return member_list[0].get('group', {}).get('permission', None) in ['OWNER', 'ADMINISTRATOR']
-        for member in member_list:
-            member_qq = member.get('id', None)
-            member_permission = member.get('permission', None)
-            if member_qq == qq:
-                if member_permission in ['OWNER', 'ADMINISTRATOR']:
-                    return True
-                else:
-                    return False
-        return False
+        return await self.__member_permission(qq, group) in ('OWNER', 'ADMINISTRATOR')
+
+    async def __member_permission(self, qq: int, group: int) -> Optional[str]:
+        """从 member_cache 查询成员权限，缓存未加载或已过期时重新获取群成员列表"""
+        if not self.member_cache.fresh(group):
+            await self.member_list(group)
+        return self.member_cache.permission(group, qq)
 
     @classmethod
-    def receiver(cls, msg_type):
+    def receiver(cls, msg_type, key=None):
+        """注册消息处理函数
+        :param msg_type: 消息或事件类型
+        :param key: 顺序键，可以是消息的属性名（如 'group'、'sender'）或以消息为参数的函数；
+            顺序键相同的消息按接收顺序依次处理，顺序键不同的消息并发处理，默认不保证顺序
+        """
         def wrapper(func):
             if msg_type not in cls.receiver_funcs:
                 cls.receiver_funcs[msg_type] = [func]
             else:
                 cls.receiver_funcs[msg_type].append(func)
+            if key is not None:
+                cls.receiver_keys[func] = key
             return func
 
         return wrapper
@@ -0,0 +1,233 @@
+import collections
+import threading
+import time
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from .message import GroupMessage, TempMessage
+from .events import *
+
+
+class MemberInfo:
+    """缓存的群成员信息"""
+
+    __slots__ = ('permission', 'name', 'special_title')
+
+    def __init__(self, permission: Optional[str] = None, name: Optional[str] = None,
+                 special_title: Optional[str] = None):
+        """
+        :param permission: 'OWNER'、'ADMINISTRATOR' 或 'MEMBER'
+        :param name: 群名片
+        :param special_title: 群头衔
+        """
+        self.permission = permission
+        self.name = name
+        self.special_title = special_title
+
+    def __repr__(self):
+        return f'MemberInfo({self.permission}, {self.name!r}, {self.special_title!r})'
+
+
+class MemberCache:
+    """群成员缓存，按 (群号, QQ 号) 查询
+
+    一个群的成员在第一次需要时从 memberList 整体加载，超过 ttl 秒后重新加载；
+    在此期间由群消息与成员变动事件增量更新。加载时整体替换该群的字典，读取不需要加锁。
+    """
+
+    def __init__(self, bot_qq: Optional[int] = None, ttl: float = 600.):
+        """
+        :param bot_qq: bot 的 QQ 号，bot 自身的权限从成员的 group 字段中得到
+        :param ttl: 群成员列表的有效时间，单位为秒
+        """
+        self.bot_qq: Optional[int] = bot_qq
+        self.ttl: float = ttl
+
+        self.__groups: Dict[int, Dict[int, MemberInfo]] = {}
+        self.__loaded_at: Dict[int, float] = {}
+
+    def fresh(self, group: int) -> bool:
+        """群成员列表是否已加载且未过期"""
+        loaded_at = self.__loaded_at.get(group, None)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def load(self, group: int, members: Iterable[dict]):
+        """用 memberList 的结果替换一个群的成员
+        :param members: memberList 响应中的 data
+        """
+        cached = {}
+        bot_permission = None
+        for member in members:
+            cached[member.get('id', None)] = MemberInfo(member.get('permission', None),
+                                                        member.get('memberName', None),
+                                                        member.get('specialTitle', None))
+            bot_permission = member.get('group', {}).get('permission', bot_permission)
+        if self.bot_qq is not None and bot_permission is not None:
+            cached[self.bot_qq] = MemberInfo(bot_permission)
+        self.__groups[group] = cached
+        self.__loaded_at[group] = time.monotonic()
+
+    def get(self, group: int, qq: int) -> Optional[MemberInfo]:
+        """返回缓存的成员信息，不在缓存中时返回 None"""
+        return self.__groups.get(group, {}).get(qq, None)
+
+    def permission(self, group: int, qq: int) -> Optional[str]:
+        """返回缓存的成员权限，不在缓存中时返回 None"""
+        member = self.get(group, qq)
+        return member.permission if member else None
+
+    def invalidate(self, group: Optional[int] = None):
+        """使一个群或所有群的缓存失效"""
+        if group is None:
+            self.__groups = {}
+            self.__loaded_at = {}
+        else:
+            self.__groups.pop(group, None)
+            self.__loaded_at.pop(group, None)
+
+    def observe(self, msg):
+        """根据收到的消息或事件更新已加载的群"""
+        if isinstance(msg, (GroupMessage, TempMessage)):
+            self.__update(msg.group, msg.sender, permission=msg.sender_permission, name=msg.sender_name)
+        elif isinstance(msg, MemberLeaveEvent):
+            self.__groups.get(msg.group, {}).pop(msg.member, None)
+        elif isinstance(msg, BotLeaveEvent):
+            self.invalidate(msg.group)
+        elif isinstance(msg, BotGroupPermissionChangeEvent):
+            self.__update(msg.group, self.bot_qq, permission=msg.current)
+        elif isinstance(msg, GroupEvent):
+            self.__update(msg.group, msg.operator, permission=msg.operator_permission, name=msg.operator_name)
+            self.__update(msg.group, msg.member, permission=msg.member_permission, name=msg.member_name)
+            if isinstance(msg, MemberCardChangeEvent):
+                self.__update(msg.group, msg.member, name=msg.current)
+            elif isinstance(msg, MemberAttributeChangeEvent):
+                if msg.type == 'MemberPermissionChangeEvent':
+                    self.__update(msg.group, msg.member, permission=msg.current)
+                else:
+                    self.__update(msg.group, msg.member, special_title=msg.current)
+
+    def __update(self, group: int, qq: Optional[int], **fields):
+        members = self.__groups.get(group, None)
+        if members is None or qq is None:
+            return
+        member = members.get(qq, None)
+        if member is None:
+            member = members[qq] = MemberInfo()
+        for name, value in fields.items():
+            if value is not None:
+                setattr(member, name, value)
+
+
+class ContactDirectory:
+    """好友与群列表的本地副本
+
+    bot 连接后立即加载，之后每隔 refresh_interval 秒在后台重新加载，期间由好友与群变动事件增量更新。
+    每次修改都生成新的字典替换旧的，friends 与 groups 返回的快照不会再被修改，读取不需要加锁。
+    事件带来的修改同时记入一个有界的日志；重新加载时，请求发出之后（mark 之后）记录的修改会重新应用到新的列表上，
+    加载期间收到的事件不会被请求发出前的快照覆盖。
+    """
+
+    def __init__(self, refresh_interval: Optional[float] = 600., journal_size: int = 1024):
+        """
+        :param refresh_interval: 后台重新加载的间隔，单位为秒，为空时只在连接后加载一次
+        :param journal_size: 保留的修改记录数量
+        """
+        self.refresh_interval: Optional[float] = refresh_interval
+        self.loaded: bool = False
+
+        self.__friends: Dict[int, dict] = {}
+        self.__groups: Dict[int, dict] = {}
+        self.__lock = threading.Lock()
+        self.__seq = 0
+        self.__journal: Deque[Tuple[int, str, int, Optional[dict], bool]] = collections.deque(maxlen=journal_size)
+
+    @property
+    def friends(self) -> Dict[int, dict]:
+        """好友 QQ 号到 friendList 中好友信息的字典，不要修改"""
+        return self.__friends
+
+    @property
+    def groups(self) -> Dict[int, dict]:
+        """群号到 groupList 中群信息的字典，不要修改"""
+        return self.__groups
+
+    def is_friend(self, qq: int) -> bool:
+        return qq in self.__friends
+
+    def has_group(self, group: int) -> bool:
+        return group in self.__groups
+
+    def mark(self) -> int:
+        """在请求 friendList 或 groupList 之前调用，返回值作为 load_friends 或 load_groups 的 since 参数"""
+        return self.__seq
+
+    def load_friends(self, friends: Iterable[dict], since: Optional[int] = None):
+        """用 friendList 响应中的 data 替换好友列表
+        :param since: 请求发出前 mark 的返回值，之后记录的修改会应用到新的列表上
+        """
+        friends = {friend.get('id', None): friend for friend in friends}
+        with self.__lock:
+            self.__friends = self.__replay(friends, 'friends', since)
+        self.loaded = True
+
+    def load_groups(self, groups: Iterable[dict], since: Optional[int] = None):
+        """用 groupList 响应中的 data 替换群列表
+        :param since: 请求发出前 mark 的返回值，之后记录的修改会应用到新的列表上
+        """
+        groups = {group.get('id', None): group for group in groups}
+        with self.__lock:
+            self.__groups = self.__replay(groups, 'groups', since)
+        self.loaded = True
+
+    def observe(self, msg):
+        """根据收到的事件更新好友与群列表"""
+        if isinstance(msg, FriendChangeEvent):
+            if msg.type == 'FriendAddEvent':
+                self.__change('friends', msg.friend, {'id': msg.friend, 'nickname': msg.friend_name,
+                                                      'remark': msg.friend_remark})
+            else:
+                self.__change('friends', msg.friend, None)
+        elif isinstance(msg, FriendNickChangedEvent):
+            self.__change('friends', msg.friend, {'nickname': msg.current}, patch=True)
+        elif isinstance(msg, BotJoinGroupEvent):
+            self.__change('groups', msg.group, {'id': msg.group, 'name': msg.group_name, 'permission': 'MEMBER'})
+        elif isinstance(msg, BotLeaveEvent):
+            self.__change('groups', msg.group, None)
+        elif isinstance(msg, (GroupSettingChangeEvent, BotGroupPermissionChangeEvent)):
+            if msg.type == 'GroupNameChangeEvent':
+                self.__change('groups', msg.group, {'name': msg.current}, patch=True)
+            elif msg.type == 'BotGroupPermissionChangeEvent':
+                self.__change('groups', msg.group, {'permission': msg.current}, patch=True)
+
+    def __change(self, kind: str, key: int, value: Optional[dict], patch: bool = False):
+        """记录并应用一次修改
+        :param kind: 'friends' 或 'groups'
+        :param value: 新的信息，为 None 时删除
+        :param patch: 为 True 时只更新已存在条目的部分字段
+        """
+        with self.__lock:
+            self.__seq += 1
+            self.__journal.append((self.__seq, kind, key, value, patch))
+            if kind == 'friends':
+                self.__friends = self.__apply(dict(self.__friends), key, value, patch)
+            else:
+                self.__groups = self.__apply(dict(self.__groups), key, value, patch)
+
+    def __replay(self, contacts: Dict[int, dict], kind: str, since: Optional[int]) -> Dict[int, dict]:
+        if since is None:
+            return contacts
+        for seq, entry_kind, key, value, patch in self.__journal:
+            if seq > since and entry_kind == kind:
+                self.__apply(contacts, key, value, patch)
+        return contacts
+
+    @staticmethod
+    def __apply(contacts: Dict[int, dict], key: int, value: Optional[dict], patch: bool) -> Dict[int, dict]:
+        if patch:
+            current = contacts.get(key, None)
+            if current is not None:
+                contacts[key] = dict(current, **value)
+        elif value is None:
+            contacts.pop(key, None)
+        else:
+            contacts[key] = value
+        return contacts
@@ -0,0 +1,413 @@
+from typing import Optional, Callable, Dict
+
+from .message import *
+from .utils import color
+
+
+__event_types: Dict[str, Callable] = {}
+
+
+def register_event(*event_types: str):
+    """将类注册为一个或多个事件类型的解析类，缺省时使用类名作为事件类型；
+    解析类以 (msg, bot_qq) 为参数构造，可覆盖已注册的类型
+    :param event_types: mirai-api-http 中的事件类型名
+    """
+
+    def wrapper(cls):
+        for event_type in event_types or (cls.__name__,):
+            __event_types[event_type] = cls
+        return cls
+
+    return wrapper
+
+
+def parse_event(msg: dict, bot_qq: int):
+    """将 mirai-api-http 推送的 json 解析为消息或事件对象，未注册的类型原样返回"""
+    event_type = __event_types.get(msg.get('type', None), None)
+    if event_type is None:
+        return msg
+    return event_type(msg, bot_qq)
+
+
+def event_types() -> Dict[str, Callable]:
+    """返回已注册的事件类型与解析类的字典"""
+    return dict(__event_types)
+
+
+for _message_type in (GroupMessage, FriendMessage, TempMessage, StrangerMessage, OtherClientMessage):
+    register_event()(_message_type)
+del _message_type
+
+
+class Event:
+    """事件基类，将 Event.compact 设为 True 后不保留原始 json；
+    为兼容以 dict 接收事件的处理函数，可以像 dict 一样按键读取原始 json，如 event['member']['group']['id']"""
+
+    __slots__ = ('json', 'type')
+    compact: bool = False
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        self.json = None if self.compact else msg
+        self.type = msg.get('type', None)
+
+    def __repr__(self):
+        return f'{self.type}'
+
+    def __getitem__(self, key):
+        return self.__raw()[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.__raw()
+
+    def get(self, key, default=None):
+        return self.__raw().get(key, default)
+
+    def __raw(self) -> dict:
+        if self.json is None:
+            raise TypeError(f'{self.type} 没有保留原始 json（Event.compact 为 True），请使用事件的属性')
+        return self.json
+
+
+class GroupEvent(Event):
+    """带有群信息的事件基类，解析 group、member 与 operator 字段"""
+
+    __slots__ = ('member', 'member_name', 'member_permission', 'group', 'group_name',
+                 'operator', 'operator_name', 'operator_permission')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        member = msg.get('member', None) or {}
+        self.member = member.get('id', None)
+        self.member_name = member.get('memberName', None)
+        self.member_permission = member.get('permission', None)
+        group = msg.get('group', None) or member.get('group', None) or {}
+        self.group = group.get('id', None)
+        self.group_name = group.get('name', None)
+        operator = msg.get('operator', None) or {}
+        self.operator = operator.get('id', None)
+        self.operator_name = operator.get('memberName', None)
+        self.operator_permission = operator.get('permission', None)
+        if self.group is None:
+            group = operator.get('group', None) or {}
+            self.group = group.get('id', None)
+            self.group_name = group.get('name', None)
+
+    def __repr__(self):
+        return f'{self.type} {self.group_name}({self.group})'
+
+
+@register_event('BotOnlineEvent', 'BotReloginEvent')
+class BotOnlineEvent(Event):
+    __slots__ = ('qq',)
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.qq = msg.get('qq', None)
+
+    def __repr__(self):
+        return color(self.type, 'green')
+
+
+@register_event('BotOfflineEventActive', 'BotOfflineEventForce', 'BotOfflineEventDropped')
+class BotOfflineEvent(Event):
+    __slots__ = ('qq',)
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.qq = msg.get('qq', None)
+
+    def __repr__(self):
+        return color(self.type, 'red')
+
+
+@register_event()
+class BotGroupPermissionChangeEvent(GroupEvent):
+    __slots__ = ('origin', 'current')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.origin = msg.get('origin', None)
+        self.current = msg.get('current', None)
+
+    def __repr__(self):
+        return f'BotGroupPermissionChangeEvent {self.group_name}({self.group})' \
+               f' - permission changed from {self.origin} to {self.current}'
+
+
+@register_event()
+class BotMuteEvent(GroupEvent):
+    __slots__ = ('duration',)
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.duration = msg.get('durationSeconds', None)
+
+    def __repr__(self):
+        return f'BotMuteEvent {self.group_name}({self.group})' \
+               f' - muted for {self.duration}s by {self.operator_name}({self.operator})'
+
+
+@register_event()
+class BotUnmuteEvent(GroupEvent):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'BotUnmuteEvent {self.group_name}({self.group})' \
+               f' - unmuted by {self.operator_name}({self.operator})'
+
+
+@register_event()
+class BotJoinGroupEvent(GroupEvent):
+    __slots__ = ('invitor', 'invitor_name')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        invitor = msg.get('invitor', None) or {}
+        self.invitor = invitor.get('id', None)
+        self.invitor_name = invitor.get('memberName', None)
+
+
+@register_event('BotLeaveEventActive', 'BotLeaveEventKick', 'BotLeaveEventDisband')
+class BotLeaveEvent(GroupEvent):
+    __slots__ = ()
+
+
+@register_event()
+class FriendInputStatusChangedEvent(Event):
+    __slots__ = ('friend', 'friend_name', 'inputting')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        friend = msg.get('friend', None) or {}
+        self.friend = friend.get('id', None)
+        self.friend_name = friend.get('nickname', None)
+        self.inputting = msg.get('inputting', False)
+
+
+@register_event()
+class FriendNickChangedEvent(Event):
+    __slots__ = ('friend', 'origin', 'current')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        friend = msg.get('friend', None) or {}
+        self.friend = friend.get('id', None)
+        self.origin = msg.get('from', None)
+        self.current = msg.get('to', None)
+
+    def __repr__(self):
+        return f"FriendNickChangedEvent - {self.friend}'s nickname was changed" \
+               f" from '{self.origin}' to '{self.current}'"
+
+
+@register_event('FriendAddEvent', 'FriendDeleteEvent')
+class FriendChangeEvent(Event):
+    __slots__ = ('friend', 'friend_name', 'friend_remark', 'stranger')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        friend = msg.get('friend', None) or {}
+        self.friend = friend.get('id', None)
+        self.friend_name = friend.get('nickname', None)
+        self.friend_remark = friend.get('remark', None)
+        self.stranger = msg.get('stranger', False)
+
+    def __repr__(self):
+        return f'{self.type} - {self.friend_name}({self.friend})'
+
+
+@register_event()
+class FriendRecallEvent(Event):
+    """好友撤回消息事件，message 为 message_store 中的原消息，不在其中时为 None"""
+
+    __slots__ = ('id', 'author', 'time', 'operator', 'message')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.id = msg.get('messageId', None)
+        self.author = msg.get('authorId', None)
+        self.time = msg.get('time', None)
+        self.operator = msg.get('operator', None)
+        self.message = None
+
+    def __repr__(self):
+        return f'FriendRecallEvent #{self.id} - {self.operator} recalled a message from {self.author}'
+
+
+@register_event()
+class NudgeEvent(Event):
+    __slots__ = ('sender', 'subject', 'kind', 'action', 'suffix', 'target', 'group')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.sender = msg.get('fromId', None)
+        subject = msg.get('subject', None) or {}
+        self.subject = subject.get('id', None)
+        self.kind = subject.get('kind', None)
+        self.action = msg.get('action', None)
+        self.suffix = msg.get('suffix', None)
+        self.target = msg.get('target', None)
+        self.group = self.subject if self.kind == 'Group' else None
+
+    def __repr__(self):
+        return f'NudgeEvent {self.kind}({self.subject}) - {self.sender} {self.action} {self.target} {self.suffix}'
+
+
+@register_event()
+class GroupRecallEvent(GroupEvent):
+    """群消息撤回事件，message 为 message_store 中的原消息，不在其中时为 None"""
+
+    __slots__ = ('id', 'author', 'message')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.id = msg.get('messageId', None)
+        self.author = msg.get('authorId', None)
+        self.message = None
+
+    def __repr__(self):
+        return f'GroupRecallEvent #{self.id} {self.group_name}({self.group})' \
+               f' - {self.operator_name}({self.operator}) recalled a message from {self.author}'
+
+
+@register_event('GroupNameChangeEvent', 'GroupEntranceAnnouncementChangeEvent', 'GroupMuteAllEvent',
+                'GroupAllowAnonymousChatEvent', 'GroupAllowConfessTalkEvent', 'GroupAllowMemberInviteEvent')
+class GroupSettingChangeEvent(GroupEvent):
+    __slots__ = ('origin', 'current', 'by_bot')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.origin = msg.get('origin', None)
+        self.current = msg.get('current', None)
+        self.by_bot = msg.get('isByBot', False)
+
+    def __repr__(self):
+        return f"{self.type} {self.group_name}({self.group})" \
+               f" - changed from '{self.origin}' to '{self.current}' by {self.operator_name}({self.operator})"
+
+
+@register_event()
+class MemberJoinEvent(GroupEvent):
+    __slots__ = ('invitor', 'invitor_name')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        invitor = msg.get('invitor', None) or {}
+        self.invitor = invitor.get('id', None)
+        self.invitor_name = invitor.get('memberName', None)
+
+    def __repr__(self):
+        return f'MemberJoinEvent {self.group_name}({self.group}) - {self.member_name}({self.member}) joined'
+
+
+@register_event('MemberLeaveEventKick', 'MemberLeaveEventQuit')
+class MemberLeaveEvent(GroupEvent):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'{self.type} {self.group_name}({self.group}) - {self.member_name}({self.member}) left'
+
+
+@register_event()
+class MemberCardChangeEvent(GroupEvent):
+    __slots__ = ('origin', 'current')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.origin = msg.get('origin', None)
+        self.current = msg.get('current', None)
+
+    def __repr__(self):
+        return f"MemberCardChangeEvent {self.group_name}({self.group})" \
+               f" - {self.member_name}({self.member})'s card was changed from '{self.origin}' to '{self.current}'" \
+               f" by {self.operator_name}({self.operator})"
+
+
+@register_event('MemberSpecialTitleChangeEvent', 'MemberPermissionChangeEvent')
+class MemberAttributeChangeEvent(GroupEvent):
+    __slots__ = ('origin', 'current')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.origin = msg.get('origin', None)
+        self.current = msg.get('current', None)
+
+    def __repr__(self):
+        return f"{self.type} {self.group_name}({self.group})" \
+               f" - {self.member_name}({self.member}) changed from '{self.origin}' to '{self.current}'"
+
+
+@register_event()
+class MemberMuteEvent(GroupEvent):
+    __slots__ = ('duration',)
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.duration = msg.get('durationSeconds', None)
+
+    def __repr__(self):
+        return f'MemberMuteEvent {self.group_name}({self.group}) - {self.member_name}({self.member})' \
+               f' was muted for {self.duration}s by {self.operator_name}({self.operator})'
+
+
+@register_event()
+class MemberUnmuteEvent(GroupEvent):
+    __slots__ = ()
+
+    def __repr__(self):
+        return f'MemberUnmuteEvent {self.group_name}({self.group}) - {self.member_name}({self.member})' \
+               f' was unmuted by {self.operator_name}({self.operator})'
+
+
+@register_event()
+class MemberHonorChangeEvent(GroupEvent):
+    __slots__ = ('action', 'honor')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.action = msg.get('action', None)
+        self.honor = msg.get('honor', None)
+
+
+@register_event('NewFriendRequestEvent', 'MemberJoinRequestEvent', 'BotInvitedJoinGroupRequestEvent')
+class RequestEvent(Event):
+    __slots__ = ('event_id', 'sender', 'sender_name', 'group', 'group_name', 'message')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.event_id = msg.get('eventId', None)
+        self.sender = msg.get('fromId', None)
+        self.sender_name = msg.get('nick', None)
+        self.group = msg.get('groupId', None)
+        self.group_name = msg.get('groupName', None)
+        self.message = msg.get('message', None)
+
+    def __repr__(self):
+        return f'{self.type} #{self.event_id} - {self.sender_name}({self.sender}): {self.message.__repr__()}'
+
+
+@register_event('OtherClientOnlineEvent', 'OtherClientOfflineEvent')
+class OtherClientEvent(Event):
+    __slots__ = ('client', 'platform', 'kind')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        client = msg.get('client', None) or {}
+        self.client = client.get('id', None)
+        self.platform = client.get('platform', None)
+        self.kind = msg.get('kind', None)
+
+
+@register_event()
+class CommandExecutedEvent(Event):
+    __slots__ = ('name', 'sender', 'group', 'args')
+
+    def __init__(self, msg: dict, bot_qq: Optional[int] = None):
+        super().__init__(msg, bot_qq)
+        self.name = msg.get('name', None)
+        friend = msg.get('friend', None) or {}
+        member = msg.get('member', None) or {}
+        self.sender = friend.get('id', None) or member.get('id', None)
+        group = member.get('group', None) or {}
+        self.group = group.get('id', None)
+        self.args = msg.get('args', [])
@@ -1,9 +1,12 @@
 import json
 import os
 import threading
+from typing import Dict, FrozenSet, Iterable, Set
 
 from .message import *
+from .events import *
 from .utils import end_log
+from .storage import ConfigStore
 from .mirai import Mirai
 from .asyncmirai import AsyncMirai
 
@@ -11,10 +14,19 @@ from .asyncmirai import AsyncMirai
 class BaseFilter(ABC):
     """过滤器基类，不可实例化"""
 
-    def __init__(self, config_file=None):
+    def __init__(self, config_file=None, flush_interval: float = 1., journal: bool = False):
+        """
+        :param config_file: 配置文件路径
+        :param flush_interval: 配置修改后写入文件的最长延迟，单位为秒
+        :param journal: 是否使用追加日志记录修改，适合配置较大且修改频繁的情况
+        """
         self.config_file = config_file
         self.config = {}
+        self._lock = threading.Lock()
+        self._store: Optional[ConfigStore] = None
         if config_file:
+            self._store = ConfigStore(config_file, lock=self._lock,
+                                      flush_interval=flush_interval, journal=journal)
             self._load_config()
 
     @abstractmethod
@@ -36,38 +48,42 @@ class BaseFilter(ABC):
 
     @end_log
     def _load_config(self):
-        if not os.path.exists(self.config_file):
+        existed = os.path.exists(self.config_file)
+        self.config = self._store.load()
+        if not existed:
             self._save_config()
-        with open(self.config_file, 'r', encoding='utf-8') as f:
-            self.config = json.load(f)
+            self.flush_config()
 
-    @end_log
-    def _save_config(self):
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=4)
+    def _save_config(self, *keys):
+        """在后台写入配置文件，keys 为被修改的顶层键，为空时写入完整配置；
+        调用者应持有 self._lock"""
+        if self._store:
+            self._store.save(self.config, *keys)
+
+    def flush_config(self):
+        """立即写入所有尚未写入的配置修改"""
+        if self._store:
+            self._store.flush()
 
 
 class GroupSwitchFilter(BaseFilter):
     """群组件开关"""
 
-    def __init__(self, config_file):
-        super().__init__(config_file)
+    def __init__(self, config_file, **kwargs):
+        super().__init__(config_file, **kwargs)
         self.__funcs = []
         self.__func_names = []
-        self.__lock = threading.Lock()
+        self.__index: Dict[int, FrozenSet[str]] = {}
+        self.__rebuild_index()
 
     def sift(self, funcs, bot: Union[Mirai, AsyncMirai], msg):
         if not self.__funcs:
             self.__set_funcs(bot.receiver_funcs)
         if isinstance(msg, (GroupMessage, GroupRecallEvent)):
-            funcs_o = []
-            group = str(msg.group)
-            for func in funcs:
-                if group not in self.config:
-                    self.config[group] = []
-                if func.__name__ in self.config[group]:
-                    funcs_o.append(func)
-            return funcs_o
+            enabled = self.__index.get(msg.group, None)
+            if not enabled:
+                return []
+            return [func for func in funcs if func.__name__ in enabled]
         return funcs
 
     def __set_funcs(self, event):
@@ -76,12 +92,25 @@ class GroupSwitchFilter(BaseFilter):
         self.__funcs = group_message_funcs + group_recall_event_funcs
         self.__func_names = [func.__name__ for func in self.__funcs]
 
+    def __rebuild_index(self, *groups):
+        """重建索引，读者总是拿到完整的快照；groups 为空时重建所有群"""
+        index = dict(self.__index) if groups else {}
+        for group in groups or self.config:
+            try:
+                index[int(group)] = frozenset(self.config.get(str(group), []))
+            except ValueError:
+                continue
+        self.__index = index
+
     def enable(self, group, func_name):
         """在群组 group 启用名为 func_name 的组件"""
         if func_name in self.__func_names:
-            with self.__lock:
-                self.config[str(group)].append(func_name)
-                self._save_config()
+            with self._lock:
+                enabled = self.config.setdefault(str(group), [])
+                if func_name not in enabled:
+                    enabled.append(func_name)
+                    self.__rebuild_index(group)
+                    self._save_config(str(group))
             return True
         else:
             return False
@@ -89,34 +118,39 @@ class GroupSwitchFilter(BaseFilter):
     def disable(self, group, func_name):
         """在群组 group 禁用名为 func_name 的组件"""
         if func_name in self.__func_names:
-            with self.__lock:
-                if func_name in self.config[str(group)]:
-                    self.config[str(group)].remove(func_name)
-                self._save_config()
+            with self._lock:
+                enabled = self.config.setdefault(str(group), [])
+                if func_name in enabled:
+                    enabled.remove(func_name)
+                    self.__rebuild_index(group)
+                    self._save_config(str(group))
             return True
         else:
             return False
 
     def enable_all(self, group):
         """在群组 group 启用所有组件"""
-        with self.__lock:
-            self.config[str(group)] = self.__func_names
-            self._save_config()
+        with self._lock:
+            self.config[str(group)] = list(self.__func_names)
+            self.__rebuild_index(group)
+            self._save_config(str(group))
         return True
 
     def disable_all(self, group):
         """在群组 group 禁用所有组件"""
-        with self.__lock:
-            self.config[str(group)].clear()
-            self._save_config()
+        with self._lock:
+            self.config[str(group)] = []
+            self.__rebuild_index(group)
+            self._save_config(str(group))
         return True
 
     def funcs_info(self, group=None):
         """显示所有组件信息"""
         if group:
+            enabled = self.__index.get(int(group), frozenset())
             return [{'func': func.__name__,
                      'help': func.__doc__,
-                     'enabled': func.__name__ in self.config[str(group)]}
+                     'enabled': func.__name__ in enabled}
                     for func in self.__funcs]
         else:
             return [{'func': func.__name__,
@@ -127,44 +161,95 @@ class GroupSwitchFilter(BaseFilter):
 class BlacklistFilter(BaseFilter):
     """黑名单"""
 
-    def __init__(self, config_file):
-        super().__init__(config_file)
+    def __init__(self, config_file, **kwargs):
+        super().__init__(config_file, **kwargs)
         if 'blacklist' not in self.config:
             self.config['blacklist'] = []
-            self._save_config()
-        self.__lock = threading.Lock()
+            self._save_config('blacklist')
+        self.__members: Set[int] = {int(qq) for qq in self.config['blacklist']}
+        self.__snapshot: Optional[FrozenSet[int]] = None
 
     def sift(self, funcs, bot: Union[Mirai, AsyncMirai], msg):
         if isinstance(msg, (GroupMessage, FriendMessage, TempMessage)):
-            if str(msg.sender) in self.config['blacklist']:
+            if msg.sender in self.__frozen():
                 return []
         return funcs
 
+    def __contains__(self, qq):
+        return int(qq) in self.__frozen()
+
+    def __frozen(self) -> FrozenSet[int]:
+        """返回黑名单的只读快照，黑名单修改后在下一次读取时重新生成"""
+        snapshot = self.__snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self.__snapshot
+                if snapshot is None:
+                    snapshot = self.__snapshot = frozenset(self.__members)
+        return snapshot
+
     def append(self, qq):
         """向黑名单中添加成员"""
-        if qq not in self.config['blacklist']:
-            with self.__lock:
-                self.config['blacklist'].append(str(qq))
-                self._save_config()
-            return True
-        else:
-            return False
+        return self.append_many([qq]) == 1
+
+    def append_many(self, qqs: Iterable):
+        """向黑名单中批量添加成员，只写入一次配置文件
+        :return: 实际添加的成员数量
+        """
+        with self._lock:
+            added = []
+            for qq in qqs:
+                qq = int(qq)
+                if qq not in self.__members:
+                    self.__members.add(qq)
+                    added.append(qq)
+            if added:
+                self.config['blacklist'].extend(str(qq) for qq in added)
+                self.__snapshot = None
+                self._save_config('blacklist')
+        return len(added)
 
     def remove(self, qq):
         """从黑名单中移除成员"""
-        if str(qq) in self.config['blacklist']:
-            with self.__lock:
-                self.config['blacklist'].remove(str(qq))
-                self._save_config()
-            return True
-        else:
-            return False
+        return self.remove_many([qq]) == 1
+
+    def remove_many(self, qqs: Iterable):
+        """从黑名单中批量移除成员，只写入一次配置文件
+        :return: 实际移除的成员数量
+        """
+        with self._lock:
+            removed = {int(qq) for qq in qqs} & self.__members
+            if removed:
+                self.config['blacklist'] = [qq for qq in self.config['blacklist'] if int(qq) not in removed]
+                self.__members -= removed
+                self.__snapshot = None
+                self._save_config('blacklist')
+        return len(removed)
+
+    def import_file(self, file):
+        """从文件导入黑名单，文件内容可以是 json 列表，也可以是以空白或逗号分隔的 QQ 号
+        :return: 实际添加的成员数量
+        """
+        with open(file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        try:
+            qqs = json.loads(content)
+        except ValueError:
+            qqs = None
+        if qqs is None or isinstance(qqs, int):
+            qqs = content.replace(',', ' ').split()
+        elif not isinstance(qqs, list):
+            raise ValueError(f'{file} 的内容应为 json 列表或以空白或逗号分隔的 QQ 号，'
+                             f'而不是 {type(qqs).__name__}')
+        return self.append_many(qqs)
 
     def clear(self):
         """清空黑名单"""
-        with self.__lock:
-            self.config['blacklist'].clear()
-            self._save_config()
+        with self._lock:
+            self.config['blacklist'] = []
+            self.__members = set()
+            self.__snapshot = None
+            self._save_config('blacklist')
         return True
 
     def show(self):
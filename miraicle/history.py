@@ -0,0 +1,113 @@
+import collections
+import threading
+import time
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+from .message import BotMessage, Message
+
+StoredMessage = Union[Message, BotMessage]
+Conversation = Tuple[Optional[int], Optional[int]]
+
+
+class MessageStore:
+    """最近消息的环形缓冲区：收到的消息与 bot 发出的消息按顺序写入固定大小的槽位，
+    写满后覆盖最早的消息；按 (群号, 消息 id) 与 (群号, 发送者) 建立索引，好友与陌生人消息的群号为 None。
+
+    撤回事件通过 get 在 O(1) 时间内找到原消息；recent 返回某个群中某人最近的消息，用于引用回复。
+    """
+
+    def __init__(self, bot_qq: Optional[int] = None, capacity: int = 4096, per_sender: int = 32,
+                 ttl: Optional[float] = None):
+        """
+        :param bot_qq: bot 的 QQ 号，作为 BotMessage 的发送者
+        :param capacity: 保存的消息数量上限，超过时覆盖最早的消息
+        :param per_sender: 每个 (群号, 发送者) 保存的消息数量上限
+        :param ttl: 消息的有效时间，单位为秒，超过后查询不到，为空时只按数量淘汰
+        """
+        self.bot_qq: Optional[int] = bot_qq
+        self.capacity: int = capacity
+        self.per_sender: int = per_sender
+        self.ttl: Optional[float] = ttl
+
+        self.__lock = threading.Lock()
+        self.__slots: List[Optional[Tuple[int, float, StoredMessage, Conversation]]] = [None] * capacity
+        self.__seq = 0
+        self.__by_id: Dict[Tuple[Optional[int], int], int] = {}
+        self.__by_sender: Dict[Conversation, Deque[int]] = {}
+
+    def __len__(self) -> int:
+        return min(self.__seq, self.capacity)
+
+    def add(self, msg: StoredMessage):
+        """保存一条消息
+        :param msg: 收到的 Message 或 bot 发出的 BotMessage
+        """
+        conversation = self.__conversation(msg)
+        group = conversation[0]
+        with self.__lock:
+            seq = self.__seq
+            self.__seq += 1
+            slot = seq % self.capacity
+            if self.__slots[slot] is not None:
+                self.__unindex(*self.__slots[slot])
+            self.__slots[slot] = (seq, time.monotonic(), msg, conversation)
+            if msg.id:
+                self.__by_id[(group, msg.id)] = seq
+            lane = self.__by_sender.get(conversation, None)
+            if lane is None:
+                lane = self.__by_sender[conversation] = collections.deque(maxlen=self.per_sender)
+            lane.append(seq)
+
+    def get(self, msg_id: int, group: Optional[int] = None) -> Optional[StoredMessage]:
+        """按消息 id 查询消息，不在缓冲区中或已过期时返回 None
+        :param msg_id: 消息 id
+        :param group: 群消息与临时会话消息的群号，好友消息为 None
+        """
+        with self.__lock:
+            seq = self.__by_id.get((group, msg_id), None)
+            return None if seq is None else self.__lookup(seq)
+
+    def recent(self, group: Optional[int], sender: int, count: Optional[int] = None) -> List[StoredMessage]:
+        """返回某人最近的消息，按时间从早到晚排列
+        :param group: 群号，好友消息为 None
+        :param sender: 发送者的 QQ 号，bot 发出的消息为 bot 的 QQ 号
+        :param count: 返回的消息数量上限，为空时返回全部
+        """
+        with self.__lock:
+            lane = self.__by_sender.get((group, sender), ())
+            seqs = list(lane)[-count:] if count else list(lane)
+            messages = [self.__lookup(seq) for seq in seqs]
+        return [msg for msg in messages if msg is not None]
+
+    def clear(self):
+        with self.__lock:
+            self.__slots = [None] * self.capacity
+            self.__by_id.clear()
+            self.__by_sender.clear()
+
+    def __lookup(self, seq: int) -> Optional[StoredMessage]:
+        entry = self.__slots[seq % self.capacity]
+        if entry is None or entry[0] != seq:
+            return None
+        if self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[2]
+
+    def __unindex(self, seq: int, stored_at: float, msg: StoredMessage, conversation: Conversation):
+        """移除被覆盖的消息的索引，索引已经指向更新的消息时保留"""
+        key = (conversation[0], msg.id)
+        if msg.id and self.__by_id.get(key, None) == seq:
+            del self.__by_id[key]
+        lane = self.__by_sender.get(conversation, None)
+        if lane is not None:
+            if lane and lane[0] == seq:
+                lane.popleft()
+            if not lane:
+                del self.__by_sender[conversation]
+
+    def __conversation(self, msg: StoredMessage) -> Conversation:
+        """返回消息的 (群号, 发送者)"""
+        if isinstance(msg, BotMessage):
+            group = msg.target if msg.msg_type in ('GroupMessage', 'TempMessage') else None
+            return group, self.bot_qq
+        return getattr(msg, 'group', None), getattr(msg, 'sender', None)
@@ -0,0 +1,136 @@
+import base64 as b64
+import collections
+import hashlib
+import io
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union, BinaryIO
+
+from .message import Element, Image, FlashImage, Voice
+from .storage import ConfigStore
+
+MediaKey = Tuple[str, str, str]
+
+
+class MediaCache:
+    """内容寻址的媒体缓存：本地图片与语音按 (类型, 上传类型, 内容的 sha256) 对应到上传后得到的 imageId 或 voiceId，
+    上传类型为 'friend'、'group' 或 'temp'，不同上传类型得到的 id 不能互相使用
+
+    相同内容的图片或语音再次发送时直接使用缓存的 id，不再上传或附带 base64。
+    缓存按最近使用淘汰，条目超过 ttl 秒后失效；指定 path 时缓存会被写入 json 文件，下次启动时读取。
+    """
+
+    def __init__(self, capacity: int = 1024, ttl: Optional[float] = 7 * 24 * 3600., path: Optional[str] = None):
+        """
+        :param capacity: 缓存条目数量上限
+        :param ttl: 条目的有效时间，单位为秒，为空时不过期
+        :param path: 持久化文件路径，为空时只保存在内存中
+        """
+        self.capacity: int = capacity
+        self.ttl: Optional[float] = ttl
+
+        self.__lock = threading.Lock()
+        self.__entries: Dict[str, List] = collections.OrderedDict()
+        self.__file_digests: Dict[Tuple[str, int, int], str] = collections.OrderedDict()
+        self.__store: Optional[ConfigStore] = None
+        if path:
+            self.__store = ConfigStore(path, lock=self.__lock)
+            for name, entry in self.__store.load().items():
+                self.__entries[name] = entry
+            self.__evict()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def key(self, ele: Element, type: str) -> Optional[MediaKey]:
+        """返回本地媒体元素的缓存键，已经带有 id 或 url 的元素、以及 path 在本地不存在的元素返回 None；
+        来源为文件时使用文件内容的摘要，摘要按 (路径, 修改时间, 大小) 缓存，文件未变化时不会再次读取
+        :param type: 上传类型，'friend'、'group' 或 'temp'
+        """
+        if isinstance(ele, (Image, FlashImage)):
+            kind, media_id = 'Image', ele.image_id
+        elif isinstance(ele, Voice):
+            kind, media_id = 'Voice', ele.voice_id
+        else:
+            return None
+        if media_id or ele.url:
+            return None
+        if ele.path:
+            return (kind, type, self.digest_file(ele.path)) if os.path.isfile(ele.path) else None
+        if ele._payload is None:
+            return None
+        if isinstance(ele._payload.source, str):
+            return kind, type, self.digest_file(ele._payload.source)
+        encoded = ele._base64()
+        if encoded is None:
+            return None
+        return kind, type, hashlib.sha256(encoded.encode('ascii')).hexdigest()
+
+    def digest_file(self, path: str) -> str:
+        """返回文件内容的 sha256，文件按块读取"""
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        digest = self.__file_digests.get(file_key, None)
+        if digest is None:
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), b''):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            with self.__lock:
+                self.__file_digests[file_key] = digest
+                while len(self.__file_digests) > self.capacity:
+                    self.__file_digests.popitem(last=False)
+        return digest
+
+    @staticmethod
+    def source(ele: Element) -> Union[str, BinaryIO]:
+        """返回本地媒体元素的文件路径或内容的文件对象，用于上传"""
+        if ele.path:
+            return ele.path
+        if isinstance(ele._payload.source, str):
+            return ele._payload.source
+        return io.BytesIO(b64.b64decode(ele._base64()))
+
+    @staticmethod
+    def replace(ele: Element, media_id: str) -> Element:
+        """返回使用 media_id 的同类元素"""
+        if isinstance(ele, FlashImage):
+            return FlashImage.from_id(media_id)
+        if isinstance(ele, Image):
+            return Image.from_id(media_id)
+        return Voice(voice_id=media_id, length=ele.length)
+
+    def get(self, key: MediaKey) -> Optional[str]:
+        """返回缓存的 id，未命中或已过期时返回 None"""
+        name = ':'.join(key)
+        with self.__lock:
+            entry = self.__entries.get(name, None)
+            if entry is None:
+                return None
+            if self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self.__entries[name]
+                return None
+            self.__entries.move_to_end(name)
+            return entry[0]
+
+    def put(self, key: MediaKey, media_id: str):
+        """记录上传得到的 id"""
+        with self.__lock:
+            name = ':'.join(key)
+            self.__entries[name] = [media_id, time.time()]
+            self.__entries.move_to_end(name)
+            self.__evict()
+        if self.__store:
+            self.__store.save(self.__entries)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+        if self.__store:
+            self.__store.save(self.__entries)
+
+    def __evict(self):
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
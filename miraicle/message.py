@@ -1,15 +1,23 @@
+import io
 import time
 import random
 import base64 as b64
-from typing import Optional, Union, List
+from typing import Optional, Union, List, Dict
 from abc import ABC, abstractmethod
 
-from .utils import color
+_BASE64_CHUNK = 3 << 18
 
 
 class Element(ABC):
     """消息元素基类"""
 
+    __slots__ = ()
+    _types: Dict[str, type] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Element._types[cls.__name__] = cls
+
     @abstractmethod
     def to_json(self):
         """将消息对象转换为 json"""
@@ -24,15 +32,81 @@ class Element(ABC):
         """返回所有子类名字符串的列表"""
         return [c.__name__ for c in cls.__subclasses__()]
 
-    @classmethod
-    def _handle_base64(cls, base64: Optional[Union[bytes, str]]) -> Optional[bytes]:
-        if isinstance(base64, str):
-            return b64.b64encode(open(base64, 'rb').read())
-        else:
-            return base64
+    @staticmethod
+    def from_type(type_name: str) -> Optional[type]:
+        """根据消息元素的类型名返回对应的类，未知类型返回 None"""
+        return Element._types.get(type_name, None)
+
+    @staticmethod
+    def _encode_base64(source) -> Optional[str]:
+        """将本地媒体的来源编码为 base64 字符串
+        :param source: 文件路径或二进制文件对象时分块读取并编码，路径打开的文件在读取后立即关闭；
+            bytes 视为已经编码好的 base64
+        """
+        if source is None:
+            return None
+        if isinstance(source, (bytes, bytearray)):
+            return source.decode('ascii')
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                return Element.__encode_stream(f)
+        return Element.__encode_stream(source)
+
+    @staticmethod
+    def __encode_stream(f) -> str:
+        """按 3 字节的整数倍分块编码，结果与一次编码相同；不需要把整个文件读入内存，
+        但返回的仍是完整的字符串，峰值内存约为编码结果的两倍（StringIO 的缓冲区与返回的字符串）"""
+        encoded = io.StringIO()
+        rest = b''
+        while True:
+            chunk = f.read(_BASE64_CHUNK)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            cut = len(chunk) - len(chunk) % 3
+            encoded.write(b64.b64encode(chunk[:cut]).decode('ascii'))
+            rest = chunk[cut:]
+        encoded.write(b64.b64encode(rest).decode('ascii'))
+        return encoded.getvalue()
+
+
+class MediaPayload:
+    """本地媒体的内容，第一次需要时才读取并编码为 base64；
+    to_flash 与 to_normal 得到的元素共用同一个 MediaPayload，内容只读取与编码一次"""
+
+    __slots__ = ('source', 'encoded')
+
+    def __init__(self, source):
+        self.source = source
+        self.encoded: Optional[str] = None
+
+    def base64(self) -> Optional[str]:
+        """编码并缓存内容；来源为文件路径时保留路径，其他来源在编码后释放"""
+        if self.encoded is None and self.source is not None:
+            self.encoded = Element._encode_base64(self.source)
+            if not isinstance(self.source, str):
+                self.source = None
+        return self.encoded
+
+
+class Base64Media:
+    """Image、FlashImage 与 Voice 共用的 base64 内容，保存在 _payload 中"""
+
+    __slots__ = ()
+
+    @property
+    def base64(self) -> Optional[bytes]:
+        """base64 编码后的内容，第一次访问时才读取并编码"""
+        encoded = self._base64()
+        return encoded.encode('ascii') if encoded is not None else None
+
+    def _base64(self) -> Optional[str]:
+        return self._payload.base64() if self._payload is not None else None
 
 
 class Plain(Element):
+    __slots__ = ('text',)
+
     def __init__(self, text):
         self.text = text
 
@@ -55,6 +129,8 @@ class Plain(Element):
 
 
 class At(Element):
+    __slots__ = ('qq', 'display')
+
     def __init__(self, qq, display: str = None):
         self.qq = qq
         self.display = display
@@ -82,6 +158,8 @@ class At(Element):
 
 
 class AtAll(Element):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -103,6 +181,8 @@ class AtAll(Element):
 
 
 class Face(Element):
+    __slots__ = ('face_id', 'name')
+
     def __init__(self, face_id: int = None, name: str = None):
         self.face_id = face_id
         self.name = name
@@ -142,13 +222,15 @@ class Face(Element):
         return Face(name=name)
 
 
-class Image(Element):
+class Image(Base64Media, Element):
+    __slots__ = ('path', 'url', 'image_id', '_payload')
+
     def __init__(self, path: str = None, url: str = None, image_id: str = None,
                  base64: Optional[Union[bytes, str]] = None):
         self.path = path
         self.url = url
         self.image_id = image_id
-        self.base64 = Element._handle_base64(base64)
+        self._payload: Optional[MediaPayload] = MediaPayload(base64) if base64 is not None else None
 
     def __repr__(self):
         if not self.image_id:
@@ -171,15 +253,17 @@ class Image(Element):
             return {'type': 'Image', 'url': self.url}
         elif self.image_id:
             return {'type': 'Image', 'imageId': self.image_id}
-        elif self.base64:
-            return {'type': 'Image', 'base64': self.base64.decode('utf-8')}
+        elif self._payload is not None:
+            return {'type': 'Image', 'base64': self._base64()}
 
     @property
     def is_flash(self) -> bool:
         return False
 
     def to_flash(self) -> 'FlashImage':
-        return FlashImage(path=self.path, url=self.url, image_id=self.image_id)
+        flash = FlashImage(path=self.path, url=self.url, image_id=self.image_id)
+        flash._payload = self._payload
+        return flash
 
     def to_normal(self) -> 'Image':
         return self
@@ -205,16 +289,18 @@ class Image(Element):
 
     @staticmethod
     def from_base64(base64) -> 'Image':
-        return Image(base64=Element._handle_base64(base64))
+        return Image(base64=base64)
+
 
+class FlashImage(Base64Media, Element):
+    __slots__ = ('path', 'url', 'image_id', '_payload')
 
-class FlashImage(Element):
     def __init__(self, path: str = None, url: str = None, image_id: str = None,
                  base64: Optional[Union[bytes, str]] = None):
         self.path = path
         self.url = url
         self.image_id = image_id
-        self.base64 = Element._handle_base64(base64)
+        self._payload: Optional[MediaPayload] = MediaPayload(base64) if base64 is not None else None
 
     def __repr__(self):
         if not self.image_id:
@@ -237,15 +323,17 @@ class FlashImage(Element):
             return {'type': 'FlashImage', 'url': self.url}
         elif self.image_id:
             return {'type': 'FlashImage', 'imageId': self.image_id}
-        elif self.base64:
-            return {'type': 'FlashImage', 'base64': self.base64.decode('utf-8')}
+        elif self._payload is not None:
+            return {'type': 'FlashImage', 'base64': self._base64()}
 
     @property
     def is_flash(self) -> bool:
         return True
 
     def to_normal(self) -> Image:
-        return Image(path=self.path, url=self.url, image_id=self.image_id)
+        image = Image(path=self.path, url=self.url, image_id=self.image_id)
+        image._payload = self._payload
+        return image
 
     def to_flash(self) -> 'FlashImage':
         return self
@@ -271,17 +359,19 @@ class FlashImage(Element):
 
     @staticmethod
     def from_base64(base64) -> 'FlashImage':
-        return FlashImage(base64=Element._handle_base64(base64))
+        return FlashImage(base64=base64)
+
 
+class Voice(Base64Media, Element):
+    __slots__ = ('path', 'url', 'voice_id', 'length', '_payload')
 
-class Voice(Element):
     def __init__(self, path: str = None, url: str = None, voice_id: str = None,
                  base64: Optional[Union[bytes, str]] = None, length: int = 0):
         self.path = path
         self.url = url
         self.voice_id = voice_id
-        self.base64 = Element._handle_base64(base64)
         self.length = length
+        self._payload: Optional[MediaPayload] = MediaPayload(base64) if base64 is not None else None
 
     def __repr__(self):
         if not self.voice_id:
@@ -304,8 +394,8 @@ class Voice(Element):
             return {'type': 'Voice', 'url': self.url}
         elif self.voice_id:
             return {'type': 'Voice', 'voiceId': self.voice_id}
-        elif self.base64:
-            return {'type': 'Voice', 'base64': self.base64.decode('utf-8')}
+        elif self._payload is not None:
+            return {'type': 'Voice', 'base64': self._base64()}
 
     @staticmethod
     def from_json(json: dict) -> 'Voice':
@@ -329,10 +419,12 @@ class Voice(Element):
 
     @staticmethod
     def from_base64(base64) -> 'Voice':
-        return Voice(base64=Element._handle_base64(base64))
+        return Voice(base64=base64)
 
 
 class Xml(Element):
+    __slots__ = ('xml',)
+
     def __init__(self, xml):
         self.xml = xml
 
@@ -355,6 +447,8 @@ class Xml(Element):
 
 
 class Json(Element):
+    __slots__ = ('json',)
+
     def __init__(self, json):
         self.json = json
 
@@ -377,6 +471,8 @@ class Json(Element):
 
 
 class App(Element):
+    __slots__ = ('content',)
+
     def __init__(self, content):
         self.content = content
 
@@ -399,6 +495,8 @@ class App(Element):
 
 
 class Poke(Element):
+    __slots__ = ('name',)
+
     def __init__(self, name: str):
         self.name = name
 
@@ -421,6 +519,8 @@ class Poke(Element):
 
 
 class Dice(Element):
+    __slots__ = ('value',)
+
     def __init__(self, value: Optional[int] = None):
         self.value = value if value else random.randint(1, 6)
 
@@ -443,6 +543,8 @@ class Dice(Element):
 
 
 class File(Element):
+    __slots__ = ('file_id', 'name', 'size')
+
     def __init__(self, file_id: str, name: str, size: int):
         self.file_id = file_id
         self.name = name
@@ -469,6 +571,8 @@ class File(Element):
 
 
 class MiraiCode(Element):
+    __slots__ = ('code',)
+
     def __init__(self, code: str):
         self.code = code
 
@@ -491,82 +595,146 @@ class MiraiCode(Element):
 
 
 class BotMessage:
-    """bot 发出的消息"""
+    """bot 发出的消息，用于日志的 text 在第一次访问时生成"""
+
+    __slots__ = ('chain', 'msg_type', 'id', '_text', 'target', 'time')
 
     def __init__(self, msg_chain: List, msg_type: str = None, msg_id: int = None, target: int = None):
         self.chain = msg_chain
         self.msg_type = msg_type
         self.id = msg_id
-        self.text = ''
+        self._text = None
         self.target = target
-        for ele in self.chain:
-            if ele['type'] in Element.subclasses_str():
-                self.text += eval(ele['type']).from_json(ele).__repr__()
+        self.time = time.time()
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            text = ''
+            for ele in self.chain:
+                element_type = Element.from_type(ele['type'])
+                if element_type:
+                    text += element_type.from_json(ele).__repr__()
+            self._text = text
+        return self._text
 
     def __repr__(self):
-        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} {self.msg_type} #{self.id} - " \
+        return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.time))} {self.msg_type} #{self.id} - " \
                f"{self.target} <- {self.text.__repr__()}"
 
 
 class Message:
-    """消息基类"""
+    """消息基类，消息链在第一次访问时解析；
+    将 Message.compact 设为 True 后只保留原始消息链而不保留完整的 json，json 由原始消息链与发送者重建；
+    解析后仍保留原始消息链，json 与转发的内容不受消息链是否已被解析影响"""
+
+    __slots__ = ('_json', '_raw_chain', '_bot_qq', 'id', 'time', '_chain', '_text', '_plain', '_images')
+    compact: bool = False
 
     def __init__(self, msg: dict, bot_qq: int):
-        self.json = msg
-        self._bot_qq = bot_qq
         msg_chain = msg.get('messageChain', None)
+        if self.compact:
+            self._json = None
+            self._raw_chain = msg_chain
+        else:
+            self._json = msg
+            self._raw_chain = None
+        self._bot_qq = bot_qq
         try:
             self.id = msg_chain[0].get('id', None)
         except:
             self.id = None
-        self.time = msg_chain[0].get('time', 0)
         try:
-            self._time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.time))
+            self.time = msg_chain[0].get('time', 0)
+        except:
+            self.time = 0
+        self._chain: Optional[List[Element]] = None
+        self._text: Optional[str] = None
+        self._plain: Optional[str] = None
+        self._images: Optional[List[Union[Image, FlashImage]]] = None
+
+    @property
+    def json(self) -> dict:
+        """消息的 json"""
+        if self._json is not None:
+            return self._json
+        return {'type': self.__class__.__name__,
+                'sender': self._sender_json(),
+                'messageChain': self._raw_chain}
+
+    @json.setter
+    def json(self, value: dict):
+        self._json = value
+
+    def _sender_json(self) -> dict:
+        """compact 模式下用于重建 json 的 sender 字段"""
+        return {}
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return True if self.chain == other.chain else False
+        return False
+
+    @property
+    def _time(self) -> Optional[str]:
+        try:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.time))
         except:
-            self._time = None
+            return None
 
+    def _decode(self):
+        """解析消息链"""
         try:
             chain = []
             text = ''
+            msg_chain = self._raw_chain if self._raw_chain is not None else self._json['messageChain']
             for ele in msg_chain[1:]:
-                if ele['type'] in Element.subclasses_str():
-                    instance = eval(ele['type']).from_json(ele)
+                element_type = Element.from_type(ele['type'])
+                if element_type:
+                    instance = element_type.from_json(ele)
                     chain.append(instance)
                     text += instance.__repr__()
                 else:
                     text += f"[{ele['type']}]"
-            self.chain = chain
-            self.text = text
         except:
-            self.chain = []
-            self.text = ''
+            chain = []
+            text = ''
+        self._text = text
+        self._chain = chain
 
-    def __eq__(self, other):
-        if isinstance(other, Message):
-            return True if self.chain == other.chain else False
-        return False
+    @property
+    def chain(self) -> List[Element]:
+        """消息链"""
+        if self._chain is None:
+            self._decode()
+        return self._chain
+
+    @property
+    def text(self) -> str:
+        """消息链的字符串表示"""
+        if self._text is None:
+            self._decode()
+        return self._text
 
     @property
     def plain(self) -> str:
         """返回消息链中的所有文字"""
-        text = ''
-        for ele in self.chain:
-            if type(ele) == Plain:
-                text += ele.text
-        return text
+        if self._plain is None:
+            self._plain = ''.join(ele.text for ele in self.chain if type(ele) == Plain)
+        return self._plain
 
     @property
     def first_image(self) -> Optional[Union[Image, FlashImage]]:
         """返回消息链中的第一张图片"""
-        for ele in self.chain:
-            if isinstance(ele, (Image, FlashImage)):
-                return ele
-        return None
+        images = self.images
+        return images[0] if images else None
 
     @property
     def images(self) -> List[Union[Image, FlashImage]]:
         """返回消息链中所有图片的列表"""
-        return [ele for ele in self.chain if isinstance(ele, (Image, FlashImage))]
+        if self._images is None:
+            self._images = [ele for ele in self.chain if isinstance(ele, (Image, FlashImage))]
+        return self._images
 
     @property
     def voice(self) -> Optional[Voice]:
@@ -592,15 +760,22 @@ class Message:
 class GroupMessage(Message):
     """群消息"""
 
+    __slots__ = ('sender', 'sender_name', 'sender_permission', 'group', 'group_name')
+
     def __init__(self, msg: dict, bot_qq: int):
         super().__init__(msg, bot_qq)
         sender = msg.get('sender', {})
         self.sender = sender.get('id', None)
         self.sender_name = sender.get('memberName', None)
+        self.sender_permission = sender.get('permission', None)
         group = sender.get('group', {})
         self.group = group.get('id', None)
         self.group_name = group.get('name', None)
 
+    def _sender_json(self) -> dict:
+        return {'id': self.sender, 'memberName': self.sender_name, 'permission': self.sender_permission,
+                'group': {'id': self.group, 'name': self.group_name}}
+
     def __repr__(self):
         return f'{self._time} GroupMessage #{self.id} {self.group_name}({self.group})' \
                f' - {self.sender_name}({self.sender}): {self.text.__repr__()}'
@@ -609,89 +784,79 @@ class GroupMessage(Message):
 class FriendMessage(Message):
     """好友消息"""
 
+    __slots__ = ('sender', 'sender_name')
+
     def __init__(self, msg: dict, bot_qq: int):
         super().__init__(msg, bot_qq)
         sender = msg.get('sender', {})
         self.sender = sender.get('id', None)
         self.sender_name = sender.get('nickname', None)
 
+    def _sender_json(self) -> dict:
+        return {'id': self.sender, 'nickname': self.sender_name}
+
     def __repr__(self):
         return f'{self._time} FriendMessage #{self.id}' \
                f' - {self.sender_name}({self.sender}): {self.text.__repr__()}'
 
 
-class TempMessage(Message):
-    """群临时消息"""
+class StrangerMessage(Message):
+    """陌生人消息"""
+
+    __slots__ = ('sender', 'sender_name')
 
     def __init__(self, msg: dict, bot_qq: int):
         super().__init__(msg, bot_qq)
         sender = msg.get('sender', {})
         self.sender = sender.get('id', None)
-        self.sender_name = sender.get('memberName', None)
-        group = sender.get('group', {})
-        self.group = group.get('id', None)
-        self.group_name = group.get('name', None)
+        self.sender_name = sender.get('nickname', None)
+
+    def _sender_json(self) -> dict:
+        return {'id': self.sender, 'nickname': self.sender_name}
 
     def __repr__(self):
-        return f'{self._time} TempMessage #{self.id} {self.group_name}({self.group})' \
+        return f'{self._time} StrangerMessage #{self.id}' \
                f' - {self.sender_name}({self.sender}): {self.text.__repr__()}'
 
 
-class GroupRecallEvent:
-    def __init__(self, msg: dict):
-        self.json = msg
-        self.id = msg.get('messageId', None)
-        self.author = msg.get('authorId', None)
-        group = msg.get('group', {})
-        self.group = group.get('id', None)
-        self.group_name = group.get('name', None)
-        operator = msg.get('operator', {})
-        self.operator = operator.get('id', None)
-        self.operator_name = operator.get('memberName', None)
-        self.operator_permission = operator.get('permission', None)
+class OtherClientMessage(Message):
+    """其他客户端消息"""
 
-    def __repr__(self):
-        return f'GroupRecallEvent #{self.id} {self.group_name}({self.group})' \
-               f' - {self.operator_name}({self.operator}) recalled a message from {self.author}'
-
-
-class MemberCardChangeEvent:
-    def __init__(self, msg: dict):
-        self.json = msg
-        self.origin = msg.get('origin', None)
-        self.current = msg.get('current', None)
-        member = msg.get('member', {})
-        self.member = member.get('id', None)
-        self.member_name = member.get('memberName', None)
-        group = member.get('group', {})
-        self.group = group.get('id', None)
-        self.group_name = group.get('name', None)
-        operator = msg.get('operator', {})
-        if operator is None:
-            operator = {}
-        self.operator = operator.get('id')
-        self.operator_name = operator.get('memberName', None)
-        self.operator_permission = operator.get('permission', None)
+    __slots__ = ('sender', 'platform')
+
+    def __init__(self, msg: dict, bot_qq: int):
+        super().__init__(msg, bot_qq)
+        sender = msg.get('sender', {})
+        self.sender = sender.get('id', None)
+        self.platform = sender.get('platform', None)
+
+    def _sender_json(self) -> dict:
+        return {'id': self.sender, 'platform': self.platform}
 
     def __repr__(self):
-        return f"MemberCardChangeEvent {self.group_name}({self.group})" \
-               f" - {self.member_name}({self.member})'s card was changed from '{self.origin}' to '{self.current}'" \
-               f" by {self.operator_name}({self.operator})"
+        return f'{self._time} OtherClientMessage #{self.id}' \
+               f' - {self.platform}({self.sender}): {self.text.__repr__()}'
 
 
-class BotOnlineEvent:
-    def __init__(self, msg: dict):
-        self.json = msg
-        self.type = msg.get('type', None)
+class TempMessage(Message):
+    """群临时消息"""
 
-    def __repr__(self):
-        return color(self.type, 'green')
+    __slots__ = ('sender', 'sender_name', 'sender_permission', 'group', 'group_name')
 
+    def __init__(self, msg: dict, bot_qq: int):
+        super().__init__(msg, bot_qq)
+        sender = msg.get('sender', {})
+        self.sender = sender.get('id', None)
+        self.sender_name = sender.get('memberName', None)
+        self.sender_permission = sender.get('permission', None)
+        group = sender.get('group', {})
+        self.group = group.get('id', None)
+        self.group_name = group.get('name', None)
 
-class BotOfflineEvent:
-    def __init__(self, msg: dict):
-        self.json = msg
-        self.type = msg.get('type', None)
+    def _sender_json(self) -> dict:
+        return {'id': self.sender, 'memberName': self.sender_name, 'permission': self.sender_permission,
+                'group': {'id': self.group, 'name': self.group_name}}
 
     def __repr__(self):
-        return color(self.type, 'red')
+        return f'{self._time} TempMessage #{self.id} {self.group_name}({self.group})' \
+               f' - {self.sender_name}({self.sender}): {self.text.__repr__()}'
@@ -1,18 +1,29 @@
-import requests
 import websocket
 import json
+import queue
+import atexit
+import threading
 import concurrent.futures
-from io import BytesIO
-from typing import Dict
 
 from .utils import *
 from .message import *
+from .events import *
 from .schedule import Scheduler
-from .threadpool import ThreadPool
+from .threadpool import ThreadPool, KeyedExecutor
+from .multiplexer import Multiplexer
+from .processpool import ProcessPool
+from .ratelimit import SendLimiter, SendQueue
+from .transport import HttpTransport
+from .cache import MemberCache, ContactDirectory
+from .media import MediaCache
+from .history import MessageStore
+from .upload import MultipartStream, Progress
 
 
 class Mirai(metaclass=Singleton):
     receiver_funcs = {}
+    receiver_keys = {}
+    receiver_processes = set()
     filter_funcs = {}
     __filters = []
 
@@ -21,39 +32,70 @@ class Mirai(metaclass=Singleton):
                  verify_key: str,
                  port: int,
                  session_key: Optional[str] = None,
-                 adapter: str = 'http'):
+                 adapter: str = 'http',
+                 fetch_count: int = 100,
+                 poll_interval: float = 0.5):
         """创建一个 Mirai 对象
         :param qq: 要绑定的 bot 的 qq 号
         :param verify_key: 创建 mirai-http-server 时生成的 key, 在 mirai-api-http 的 setting 文件中手动指定
         :param port: 端口号，在 mirai-api-http 的 setting 文件中手动指定
         :param session_key: 经过校验得到的 session 号，可选
         :param adapter: 连接方式，支持 http 和 ws，默认为 http
+        :param fetch_count: http adapter 每次拉取消息的数量上限，默认为 100
+        :param poll_interval: http adapter 消息队列为空时轮询间隔的上限，单位为秒，默认为 0.5
         """
         self.qq: int = qq
         self.verify_key: str = verify_key
         self.base_url: str = f'{adapter}://localhost:{port}'
         self.session_key: Optional[str] = session_key
         self.adapter: str = adapter
+        self.fetch_count: int = fetch_count
+        self.poll_interval: float = poll_interval
         self.thread_pool: ThreadPool = ThreadPool()
-
-        self.__session: Optional[Union[requests.session, websocket.WebSocket]] = None
-        self.__msg_pool: Dict[str, json] = {}
+        self.keyed_executor: KeyedExecutor = KeyedExecutor(self.thread_pool)
+        self.processes: Optional[int] = None
+        self.process_pool: Optional[ProcessPool] = None
+        self.send_queue: Optional[SendQueue] = None
+        self.member_cache: MemberCache = MemberCache(qq)
+        self.contacts: ContactDirectory = ContactDirectory()
+        self.message_store: MessageStore = MessageStore(qq)
+        self.media_cache: Optional[MediaCache] = None
+        self.upload_slots: threading.BoundedSemaphore = threading.BoundedSemaphore(4)
+
+        self.request_timeout: float = 30.
+        self.max_in_flight: int = 64
+        self.event_queue_size: int = 1024
+        self.event_overflow: str = 'drop_oldest'
+        self.dropped_events: int = 0
+
+        self.__session: Optional[websocket.WebSocket] = None
+        self.__http: Optional[HttpTransport] = None
+        self.__mux: Optional[Multiplexer] = None
+        self.__events: Optional[queue.Queue] = None
         self.__scheduler: Scheduler = Scheduler()
 
+    @property
+    def http(self) -> HttpTransport:
+        """http 传输层，连接池大小与线程池的最大线程数量一致，另外留出主循环与发送队列使用的连接"""
+        if self.__http is None:
+            self.__http = HttpTransport(self.base_url, pool_size=self.thread_pool.max_pool_size + 2)
+        return self.__http
+
     def version(self):
         """获取 mirai-api-http 的版本号"""
-        response = requests.get(url=f'{self.base_url}/about').json()
+        response = self.http.get('about')
         if 'data' in response and 'version' in response['data']:
             return response['data']['version']
 
     def get_version(self):
         warnings.warn('get_version 方法已弃用，请使用 version 代替', DeprecationWarning)
-        response = requests.get(url=f'{self.base_url}/about').json()
+        response = self.http.get('about')
         if 'data' in response and 'version' in response['data']:
             return response['data']['version']
 
     def run(self):
         """开始运行"""
+        ensure_logging()
         if self.adapter == 'http':
             self.__http_run()
         elif self.adapter == 'ws':
@@ -61,7 +103,6 @@ class Mirai(metaclass=Singleton):
 
     def __http_run(self):
         """使用 http adapter 运行"""
-        self.__session = requests.session()
         if not self.session_key:
             verify_response = self.__http_verify()
             if all(
@@ -69,7 +110,7 @@ class Mirai(metaclass=Singleton):
                      'session' in verify_response and verify_response['session']]
             ):
                 self.session_key = verify_response['session']
-                print(f"sessionKey: {verify_response['session']}")
+                logger.info('sessionKey: %s', verify_response['session'])
                 verify_response = self.__http_bind()
                 if all(
                         ['code' in verify_response and verify_response['code'] == 0,
@@ -92,7 +133,7 @@ class Mirai(metaclass=Singleton):
                  'session' in connect_data and connect_data['session']]
         ):
             self.session_key = connect_data['session']
-            print(f"sessionKey: {connect_data['session']}")
+            logger.info('sessionKey: %s', connect_data['session'])
         else:
             if 'code' in connect_data and connect_data['code'] == 1:
                 raise ValueError('invalid verifyKey')
@@ -103,24 +144,24 @@ class Mirai(metaclass=Singleton):
     @end_log
     def __http_verify(self):
         """http 开始认证"""
-        response = self.__session.post(url=f'{self.base_url}/verify',
-                                       json={'verifyKey': self.verify_key}).json()
+        response = self.http.post('verify',
+                                  json={'verifyKey': self.verify_key})
         return response
 
     @end_log
     def __http_bind(self):
         """http 绑定 session"""
-        response = self.__session.post(url=f'{self.base_url}/bind',
-                                       json={'sessionKey': self.session_key,
-                                             'qq': self.qq}).json()
+        response = self.http.post('bind',
+                                  json={'sessionKey': self.session_key,
+                                        'qq': self.qq})
         return response
 
     @end_log
     def __http_release(self):
         """http 释放 session"""
-        response = self.__session.post(url=f'{self.base_url}/release',
-                                       json={'sessionKey': self.session_key,
-                                             'qq': self.qq}).json()
+        response = self.http.post('release',
+                                  json={'sessionKey': self.session_key,
+                                        'qq': self.qq})
         return response
 
     @end_log
@@ -131,119 +172,253 @@ class Mirai(metaclass=Singleton):
                                header={'verifyKey': self.verify_key,
                                        'qq': str(self.qq)})
         response = json.loads(self.__session.recv())
+        self.__mux = Multiplexer(self.__session.send, timeout=self.request_timeout,
+                                 max_in_flight=self.max_in_flight)
         return response
 
     def __ws_send(self, command: str, content: json):
-        """websocket 发送数据"""
-        while True:
-            sync_id = str(random.randint(0, 100_000_000))
-            if sync_id not in self.__msg_pool:
-                break
-        self.__session.send(
-            json.dumps({'syncId': sync_id,
-                        'command': command,
-                        'subCommand': None,
-                        'content': content}))
-        future = concurrent.futures.Future()
-        self.__msg_pool[sync_id] = future
-        result = future.result()
-        return result
+        """websocket 发送数据并等待响应"""
+        return self.__mux.request(command, content=content)
 
     @start_log
     def __http_main_loop(self):
         """http 主循环"""
+        self.__start_process_pool()
+        threading.Thread(target=self.__refresh_contacts, daemon=True).start()
+        threading.Thread(target=self.__call_schedule_plugins, daemon=True).start()
+        interval = 0.
         while True:
-            time.sleep(0.5)
-            self.__scheduler.run(self)
+            if interval:
+                time.sleep(interval)
             try:
-                msg_json = self.__http_fetch_msg(10)
+                msg_json = self.__http_fetch_msg(self.fetch_count)
                 msg_data = msg_json['data']
                 for msg_origin in msg_data:
                     msg_type = msg_origin.get('type', None)
                     msg = self.__handle_msg_origin(msg_origin, msg_type)
-                    print(msg)
+                    logger.info('%s', msg)
                     funcs = self.receiver_funcs.get(msg_type, [])
                     if funcs:
-                        self.thread_pool.add_task(target=self.__call_plugins, args=(funcs, msg))
+                        self.__dispatch(funcs, msg, msg_origin)
             except:
+                interval = self.poll_interval
                 continue
+            interval = next_poll_interval(interval, len(msg_data), self.fetch_count, self.poll_interval)
 
     def __http_fetch_msg(self, count):
         """http 接收消息"""
-        response = self.__session.get(url=f'{self.base_url}/fetchMessage',
-                                      params={'sessionKey': self.session_key,
-                                              'count': count}).json()
+        response = self.http.get('fetchMessage',
+                                 params={'sessionKey': self.session_key,
+                                         'count': count})
         return response
 
+    @property
+    def event_queue_depth(self) -> int:
+        """ws adapter 中等待解析与分发的事件数量"""
+        return self.__events.qsize() if self.__events else 0
+
     @start_log
     def __ws_main_loop(self):
-        """ws 主循环"""
-        self.thread_pool.add_task(target=self.__call_schedule_plugins)
+        """ws 主循环，只负责接收数据：响应直接交给等待中的请求，事件放入队列由分发线程处理"""
+        self.__start_process_pool()
+        threading.Thread(target=self.__refresh_contacts, daemon=True).start()
+        threading.Thread(target=self.__call_schedule_plugins, daemon=True).start()
+        self.__events = queue.Queue(self.event_queue_size)
+        threading.Thread(target=self.__ws_dispatch_loop, daemon=True).start()
         while True:
             try:
                 msg_json = json.loads(self.__session.recv())
                 if msg_json['syncId'] == '-1':
-                    msg_origin = msg_json['data']
-                    msg_type = msg_origin['type']
-                    msg = self.__handle_msg_origin(msg_origin, msg_type)
-                    print(msg)
-                    funcs = self.receiver_funcs.get(msg_type, [])
-                    if funcs:
-                        self.thread_pool.add_task(target=self.__call_plugins, args=(funcs, msg))
+                    self.__put_event(msg_json['data'])
                 else:
-                    response = msg_json['data']
-                    sync_id = msg_json['syncId']
-                    if sync_id in self.__msg_pool:
-                        future: concurrent.futures.Future = self.__msg_pool.pop(sync_id)
-                        future.set_result(response)
-                    else:
-                        print(color('Exception: 没有找到对应的 sync_id', 'violet'))
+                    if not self.__mux.resolve(msg_json['syncId'], msg_json['data']):
+                        logger.warning('Exception: 没有找到对应的 sync_id', extra={'color': 'violet'})
+            except websocket.WebSocketConnectionClosedException as e:
+                self.__mux.fail_all(e)
+                raise
+            except:
+                pass
+
+    def __put_event(self, msg_origin):
+        """按 event_overflow 的策略将事件放入队列：
+        'block' 等待队列空出位置，'drop_oldest' 丢弃最早的事件，'drop_newest' 丢弃新的事件；
+        'block' 等待时接收也会暂停，处理函数等待的 API 响应同样读不到，因此默认丢弃最早的事件并记录警告"""
+        if self.event_overflow == 'block':
+            self.__events.put(msg_origin)
+            return
+        while True:
+            try:
+                self.__events.put_nowait(msg_origin)
+                return
+            except queue.Full:
+                self.dropped_events += 1
+                logger.warning('事件队列已满，丢弃一个事件，共丢弃 %d 个', self.dropped_events)
+                if self.event_overflow == 'drop_newest':
+                    return
+                try:
+                    self.__events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def __ws_dispatch_loop(self):
+        """ws 分发线程，解析事件并交给线程池处理"""
+        while True:
+            msg_origin = self.__events.get()
+            try:
+                msg_type = msg_origin['type']
+                msg = self.__handle_msg_origin(msg_origin, msg_type)
+                logger.info('%s', msg)
+                funcs = self.receiver_funcs.get(msg_type, [])
+                if funcs:
+                    self.__dispatch(funcs, msg, msg_origin)
             except:
                 pass
 
-    def __call_plugins(self, funcs, msg):
+    def __dispatch(self, funcs, msg, msg_origin: dict):
+        """将消息交给线程池处理；声明了顺序键的处理函数按键串行执行
+        :param msg_origin: 原始消息，交给在子进程中运行的处理函数
+        """
+        unordered = []
+        ordered = {}
+        for func in funcs:
+            key = resolve_key(self.receiver_keys.get(func, None), msg)
+            if key is None:
+                unordered.append(func)
+            else:
+                ordered.setdefault(key, []).append(func)
+        call_filters = True
+        if unordered or not ordered:
+            self.thread_pool.add_task(target=self.__call_plugins, args=(unordered, msg, msg_origin))
+            call_filters = False
+        for key, key_funcs in ordered.items():
+            self.keyed_executor.add_task(key, target=self.__call_plugins,
+                                         args=(key_funcs, msg, msg_origin, call_filters))
+            call_filters = False
+
+    def __refresh_contacts(self):
+        """加载好友与群列表，之后按 contacts.refresh_interval 定期重新加载"""
+        while True:
+            try:
+                self.friend_list()
+                self.group_list()
+            except Exception as e:
+                logger.error('刷新好友与群列表失败: %s: %s', e.__class__.__name__, e)
+            if not self.contacts.refresh_interval:
+                return
+            time.sleep(self.contacts.refresh_interval)
+
+    def __start_process_pool(self):
+        """存在需要在子进程中运行的处理函数时创建进程池"""
+        if self.receiver_processes and self.process_pool is None:
+            self.process_pool = ProcessPool(self, self.processes)
+            atexit.register(self.process_pool.close)
+
+    def __call_plugins(self, funcs, msg, msg_origin: dict, call_filters: bool = True):
         for flt in self.__filters:
             funcs = flt.sift(funcs, self, msg)
-            flt.call(self, msg)
+            if call_filters:
+                flt.call(self, msg)
         for func in funcs:
-            func(self, msg)
+            if func in self.receiver_processes:
+                self.process_pool.run(func, msg_origin)
+            else:
+                func(self, msg)
 
     def __call_schedule_plugins(self):
-        while True:
-            self.__scheduler.run(self)
-            time.sleep(0.5)
+        self.__scheduler.run_forever(self)
 
     def __handle_msg_origin(self, msg_origin, msg_type):
-        if msg_type in ['GroupMessage', 'FriendMessage', 'TempMessage']:
-            msg = eval(msg_type)(msg_origin, self.qq)
-        elif msg_type in ['GroupRecallEvent', 'MemberCardChangeEvent']:
-            msg = eval(msg_type)(msg_origin)
-        elif msg_type in ['BotOnlineEvent', 'BotReloginEvent']:
-            msg = BotOnlineEvent(msg_origin)
-        elif msg_type in ['BotOfflineEventActive', 'BotOfflineEventForce', 'BotOfflineEventDropped']:
-            msg = BotOfflineEvent(msg_origin)
+        msg = parse_event(msg_origin, self.qq)
+        self.member_cache.observe(msg)
+        self.contacts.observe(msg)
+        if isinstance(msg, Message):
+            self.message_store.add(msg)
+        elif isinstance(msg, GroupRecallEvent):
+            msg.message = self.message_store.get(msg.id, msg.group)
+        elif isinstance(msg, FriendRecallEvent):
+            msg.message = self.message_store.get(msg.id)
+        return msg
+
+    def set_send_limit(self, rate: float = 1., burst: float = 3, global_rate: float = 10.,
+                       global_burst: float = 10, coalesce: float = 0.):
+        """限制发送消息的速率：消息先进入发送队列，按目标与全局的令牌桶轮流发送，
+        发送失败时自动降低速率；send_* 方法仍会等待并返回 mirai-api-http 的响应
+        :param rate: 每个群或好友每秒发送的消息数量
+        :param burst: 每个群或好友允许连续发送的消息数量
+        :param global_rate: 全局每秒发送的消息数量
+        :param global_burst: 全局允许连续发送的消息数量
+        :param coalesce: 合并窗口，单位为秒；同一目标在窗口内排队的消息合并为一次调用发送，
+            每个调用者都会得到合并后消息的 messageId，只有第一条消息可以引用回复，默认不合并
+        """
+        limiter = SendLimiter(rate, burst, global_rate, global_burst, coalesce=coalesce)
+        self.send_queue = SendQueue(self.__post_msg, limiter)
+
+    def __send_msg(self, target, command: str, content: dict):
+        """发送消息，设置了发送速率限制时经由发送队列发送；
+        request_timeout 秒内没有发出并得到响应时取消发送并抛出 TimeoutError"""
+        if self.send_queue is not None:
+            future = self.send_queue.submit(target, command, content)
+            try:
+                return future.result(self.request_timeout)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                raise TimeoutError(f'{command} 在 {self.request_timeout} 秒内没有完成') from None
+        return self.__post_msg(command, content)
+
+    def __post_msg(self, command: str, content: dict):
+        if self.adapter == 'http':
+            return self.http.post(command, json=content)
         else:
-            msg = msg_origin
+            assert self.adapter == 'ws'
+            return self.__ws_send(command=command, content=content)
+
+    def __apply_media_cache(self, msg, type: str):
+        """将消息中的本地图片与语音替换为 media_cache 中的 id；http adapter 下未命中时先上传再记录 id
+        :param type: 上传时使用的类型，'friend'、'group' 或 'temp'
+        """
+        if self.media_cache is None:
+            return msg
+        if isinstance(msg, (list, tuple)):
+            return [self.__cached_media(ele, type) for ele in msg]
+        elif isinstance(msg, Element):
+            return self.__cached_media(msg, type)
         return msg
 
+    def __cached_media(self, ele, type: str):
+        key = self.media_cache.key(ele, type)
+        if key is None:
+            return ele
+        media_id = self.media_cache.get(key)
+        if media_id is None and self.adapter == 'http':
+            endpoint, name, id_key = ('uploadImage', 'img', 'imageId') if key[0] == 'Image' \
+                else ('uploadVoice', 'voice', 'voiceId')
+            try:
+                response = self.__upload(endpoint, {'sessionKey': self.session_key, 'type': type},
+                                         name, self.media_cache.source(ele), None)
+            except Exception as e:
+                logger.error('上传 %s 失败: %s: %s', key[0], e.__class__.__name__, e)
+                return ele
+            media_id = response.get(id_key, None)
+            if media_id:
+                self.media_cache.put(key, media_id)
+        return self.media_cache.replace(ele, media_id) if media_id else ele
+
     def send_friend_msg(self, qq: int, msg):
         """发送好友消息
         :param qq: 发送消息目标好友的 QQ 号
         :param msg: 发送的消息
         :return: mirai-api-http 的响应
         """
+        msg = self.__apply_media_cache(msg, 'friend')
         msg_chain = self.__handle_friend_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'qq': qq,
                    'messageChain': msg_chain}
-        if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/sendFriendMessage', json=content).json()
-        else:
-            assert self.adapter == 'ws'
-            response = self.__ws_send(command='sendFriendMessage', content=content)
+        response = self.__send_msg(('friend', qq), 'sendFriendMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'FriendMessage', msg_id, qq)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     def send_temp_msg(self, group: int, qq: int, msg):
@@ -253,19 +428,17 @@ class Mirai(metaclass=Singleton):
         :param msg: 发送的消息
         :return: mirai-api-http 的响应
         """
+        msg = self.__apply_media_cache(msg, 'temp')
         msg_chain = self.__handle_friend_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'qq': qq,
                    'group': group,
                    'messageChain': msg_chain}
-        if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/sendTempMessage', json=content).json()
-        else:
-            assert self.adapter == 'ws'
-            response = self.__ws_send(command='sendTempMessage', content=content)
+        response = self.__send_msg(('temp', group, qq), 'sendTempMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'TempMessage', msg_id, group)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     @staticmethod
@@ -290,6 +463,7 @@ class Mirai(metaclass=Singleton):
         :param quote: 引用一条消息的 messageId 进行回复
         :return: mirai-api-http 的响应
         """
+        msg = self.__apply_media_cache(msg, 'group')
         msg_chain = self.__handle_group_msg_chain(msg)
         content = {'sessionKey': self.session_key,
                    'group': group,
@@ -297,14 +471,11 @@ class Mirai(metaclass=Singleton):
         if quote:
             content['quote'] = quote
 
-        if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/sendGroupMessage', json=content).json()
-        else:
-            assert self.adapter == 'ws'
-            response = self.__ws_send(command='sendGroupMessage', content=content)
+        response = self.__send_msg(('group', group), 'sendGroupMessage', content)
         msg_id = response.get('messageId', 0)
         bot_msg = BotMessage(msg_chain, 'GroupMessage', msg_id, group)
-        print(color(bot_msg, 'blue'))
+        self.message_store.add(bot_msg)
+        logger.info('%s', bot_msg, extra={'color': 'blue'})
         return response
 
     @staticmethod
@@ -335,47 +506,53 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': msg_id}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/recall', json=content).json()
+            response = self.http.post('recall', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='recall', content=content)
             return response
 
     def friend_list(self):
-        """获取好友列表"""
+        """获取好友列表，同时刷新 contacts"""
         content = {'sessionKey': self.session_key}
+        since = self.contacts.mark()
+        response = None
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/friendList', params=content).json()
-            return response
+            response = self.http.get('friendList', params=content)
         elif self.adapter == 'ws':
             response = self.__ws_send(command='friendList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.contacts.load_friends(response['data'], since)
+        return response
 
     def get_friend_list(self):
         warnings.warn('get_friend_list 方法已弃用，请使用 friend_list 代替', DeprecationWarning)
         content = {'sessionKey': self.session_key}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/friendList', params=content).json()
+            response = self.http.get('friendList', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='friendList', content=content)
             return response
 
     def group_list(self):
-        """获取群列表"""
+        """获取群列表，同时刷新 contacts"""
         content = {'sessionKey': self.session_key}
+        since = self.contacts.mark()
+        response = None
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/groupList', params=content).json()
-            return response
+            response = self.http.get('groupList', params=content)
         elif self.adapter == 'ws':
             response = self.__ws_send(command='groupList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.contacts.load_groups(response['data'], since)
+        return response
 
     def get_group_list(self):
         warnings.warn('get_group_list 方法已弃用，请使用 group_list 代替', DeprecationWarning)
         content = {'sessionKey': self.session_key}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/groupList', params=content).json()
+            response = self.http.get('groupList', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='groupList', content=content)
@@ -385,19 +562,21 @@ class Mirai(metaclass=Singleton):
         """获取群成员列表"""
         content = {'sessionKey': self.session_key,
                    'target': group}
+        response = None
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/memberList', params=content).json()
-            return response
+            response = self.http.get('memberList', params=content)
         elif self.adapter == 'ws':
             response = self.__ws_send(command='memberList', content=content)
-            return response
+        if response and response.get('code', 0) == 0 and 'data' in response:
+            self.member_cache.load(group, response['data'])
+        return response
 
     def get_member_list(self, group: int):
         warnings.warn('get_member_list 方法已弃用，请使用 member_list 代替', DeprecationWarning)
         content = {'sessionKey': self.session_key,
                    'target': group}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/memberList', params=content).json()
+            response = self.http.get('memberList', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='memberList', content=content)
@@ -409,7 +588,7 @@ class Mirai(metaclass=Singleton):
         """
         content = {'sessionKey': self.session_key}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/botProfile', params=content).json()
+            response = self.http.get('botProfile', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='botProfile', content=content)
@@ -423,7 +602,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': qq}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/friendProfile', params=content).json()
+            response = self.http.get('friendProfile', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='friendProfile', content=content)
@@ -439,7 +618,7 @@ class Mirai(metaclass=Singleton):
                    'target': group,
                    'memberId': qq}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/memberProfile', params=content).json()
+            response = self.http.get('memberProfile', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='memberProfile', content=content)
@@ -451,50 +630,48 @@ class Mirai(metaclass=Singleton):
         """
         content = {'sessionKey': self.session_key}
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/sessionInfo', params=content).json()
+            response = self.http.get('sessionInfo', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='sessionInfo', content=content)
             return response
 
-    def upload_img(self, img: Image, type='group'):
+    def upload_img(self, img: Image, type='group', progress: Optional[Progress] = None):
         """图片文件上传，当前仅支持 http
         :param img: 上传的 Image 对象
         :param type: 'friend' 或 'group' 或 'temp'
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         :return: 图片的 imageId, url 和 path
         """
-        response = self.__session.post(url=f'{self.base_url}/uploadImage',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type},
-                                       files={'img': BytesIO(open(img.path, 'rb').read())}).json()
-        return response
+        return self.__upload('uploadImage', {'sessionKey': self.session_key, 'type': type},
+                             'img', img.path, progress)
 
-    def upload_voice(self, voice: Voice, type='group'):
+    def upload_voice(self, voice: Voice, type='group', progress: Optional[Progress] = None):
         """语音文件上传，当前仅支持 http
         :param voice: 上传的 Voice 对象
         :param type: 当前仅支持 'group'
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         :return: 语音的 voiceId, url 和 path
         """
-        response = self.__session.post(url=f'{self.base_url}/uploadVoice',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type},
-                                       files={'voice': BytesIO(open(voice.path, 'rb').read())}).json()
-        return response
+        return self.__upload('uploadVoice', {'sessionKey': self.session_key, 'type': type},
+                             'voice', voice.path, progress)
 
-    def upload_file_and_send(self, path: str, group: int, file, type='Group'):
+    def upload_file_and_send(self, path: str, group: int, file, type='Group', progress: Optional[Progress] = None):
         """文件上传，当前仅支持 http
         :param path: 文件上传目录与名字
         :param group: 指定群的群号
-        :param file: 文件内容
+        :param file: 文件路径或以二进制模式打开的文件对象
         :param type: 当前仅支持 "Group"
+        :param progress: 进度回调，参数为已上传的字节数与文件大小
         """
-        response = self.__session.post(url=f'{self.base_url}/uploadFileAndSend',
-                                       data={'sessionKey': self.session_key,
-                                             'type': type,
-                                             'target': group,
-                                             'path': path},
-                                       files={'file': BytesIO(open(file, 'rb').read())}).json()
-        return response
+        return self.__upload('uploadFileAndSend', {'sessionKey': self.session_key, 'type': type,
+                                                   'target': group, 'path': path},
+                             'file', file, progress)
+
+    def __upload(self, endpoint: str, fields: dict, name: str, source, progress: Optional[Progress]):
+        """以流的方式上传文件，同时进行的上传数量受 upload_slots 限制"""
+        with self.upload_slots, MultipartStream(fields, name, source, progress=progress) as body:
+            return self.http.post(endpoint, data=body, headers=body.headers)
 
     def delete_friend(self, qq: int):
         """删除好友
@@ -503,7 +680,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': qq}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/deleteFriend', json=content).json()
+            response = self.http.post('deleteFriend', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='deleteFriend', content=content)
@@ -520,7 +697,7 @@ class Mirai(metaclass=Singleton):
                    'memberId': qq,
                    'time': time}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/mute', json=content).json()
+            response = self.http.post('mute', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='mute', content=content)
@@ -535,7 +712,7 @@ class Mirai(metaclass=Singleton):
                    'target': group,
                    'memberId': qq}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/unmute', json=content).json()
+            response = self.http.post('unmute', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='unmute', content=content)
@@ -552,7 +729,7 @@ class Mirai(metaclass=Singleton):
                    'memberId': qq,
                    'msg': msg}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/kick', json=content).json()
+            response = self.http.post('kick', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='kick', content=content)
@@ -565,7 +742,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': group}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/quit', json=content).json()
+            response = self.http.post('quit', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='quit', content=content)
@@ -578,7 +755,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': group}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/muteAll', json=content).json()
+            response = self.http.post('muteAll', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='muteAll', content=content)
@@ -591,7 +768,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': group}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/unmuteAll', json=content).json()
+            response = self.http.post('unmuteAll', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='unmuteAll', content=content)
@@ -604,7 +781,7 @@ class Mirai(metaclass=Singleton):
         content = {'sessionKey': self.session_key,
                    'target': msg_id}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/setEssence', json=content).json()
+            response = self.http.post('setEssence', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='setEssence', content=content)
@@ -621,7 +798,7 @@ class Mirai(metaclass=Singleton):
                    'memberId': qq,
                    'assign': assign}
         if self.adapter == 'http':
-            response = self.__session.post(url=f'{self.base_url}/memberAdmin', json=content).json()
+            response = self.http.post('memberAdmin', json=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send(command='memberAdmin', content=content)
@@ -647,7 +824,7 @@ class Mirai(metaclass=Singleton):
         if qq:
             content['qq'] = qq
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/file/list', params=content).json()
+            response = self.http.get('file/list', params=content)
             return response
         elif self.adapter == 'ws':
             response = self.__ws_send('file_list', content=content)
@@ -676,57 +853,52 @@ class Mirai(metaclass=Singleton):
         if qq:
             content['qq'] = qq
         if self.adapter == 'http':
-            response = self.__session.get(url=f'{self.base_url}/file/info', params=content).json()
+            response = self.http.get('file/info', params=content)
             return response
         else:
             response = self.__ws_send('file_info', content=content)
             return response
 
     def is_owner(self, qq: int, group: int):
-        """判断某成员在指定群内是否为群主
+        """判断某成员在指定群内是否为群主，群成员列表会被缓存
         :param qq: 指定群员 QQ 号
         :param group: 指定群的群号
         :return: 成员在指定群内是否为群主
         """
-        member_list = self.member_list(group)['data']
-        if qq == self.qq:
-            return member_list[0].get('group', {}).get('permission', None) == 'OWNER'
-        for member in member_list:
-            member_qq = member.get('id', None)
-            member_permission = member.get('permission', None)
-            if member_qq == qq:
-                if member_permission == 'OWNER':
-                    return True
-                else:
-                    return False
-        return False
+        return self.__member_permission(qq, group) == 'OWNER'
 
     def is_administrator(self, qq: int, group: int):
-        """判断某成员在指定群内是否为管理员
+        """判断某成员在指定群内是否为管理员，群成员列表会被缓存
         :param qq: 指定群员 QQ 号
         :param group: 指定群的群号
         :return: 成员在指定群内是否为管理员
         """
-        member_list = self.member_list(group)['data']
-        if qq == self.qq:
-            return member_list[0].get('group', {}).get('permission', None) in ['OWNER', 'ADMINISTRATOR']
-        for member in member_list:
-            member_qq = member.get('id', None)
-            member_permission = member.get('permission', None)
-            if member_qq == qq:
-                if member_permission in ['OWNER', 'ADMINISTRATOR']:
-                    return True
-                else:
-                    return False
-        return False
+        return self.__member_permission(qq, group) in ('OWNER', 'ADMINISTRATOR')
+
+    def __member_permission(self, qq: int, group: int) -> Optional[str]:
+        """从 member_cache 查询成员权限，缓存未加载或已过期时重新获取群成员列表"""
+        if not self.member_cache.fresh(group):
+            self.member_list(group)
+        return self.member_cache.permission(group, qq)
 
     @classmethod
-    def receiver(cls, msg_type):
+    def receiver(cls, msg_type, key=None, process: bool = False):
+        """注册消息处理函数
+        :param msg_type: 消息或事件类型
+        :param key: 顺序键，可以是消息的属性名（如 'group'、'sender'）或以消息为参数的函数；
+            顺序键相同的消息按接收顺序依次处理，顺序键不同的消息并行处理，默认不保证顺序
+        :param process: 是否在子进程中运行，适用于 CPU 密集的处理函数；
+            处理函数须定义在模块顶层，收到的 bot 是转发方法调用的 BotProxy，子进程数量由 bot.processes 指定
+        """
         def wrapper(func):
             if msg_type not in cls.receiver_funcs:
                 cls.receiver_funcs[msg_type] = [func]
             else:
                 cls.receiver_funcs[msg_type].append(func)
+            if key is not None:
+                cls.receiver_keys[func] = key
+            if process:
+                cls.receiver_processes.add(func)
             return func
 
         return wrapper
@@ -0,0 +1,159 @@
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import threading
+from typing import Callable, Awaitable, Dict, Optional
+
+
+def _dump_request(sync_id: str, command: str, subcommand: Optional[str], content) -> str:
+    return json.dumps({'syncId': sync_id,
+                       'command': command,
+                       'subCommand': subcommand,
+                       'content': content})
+
+
+class Multiplexer:
+    """在一个 websocket 连接上复用多个请求：syncId 单调递增，每个请求都有超时，
+    同时等待响应的请求数量受 max_in_flight 限制，连接断开时所有等待中的请求都会失败"""
+
+    def __init__(self, send: Callable[[str], None], timeout: float = 30., max_in_flight: int = 64):
+        """
+        :param send: 发送一段文本的函数
+        :param timeout: 默认的请求超时时间，单位为秒
+        :param max_in_flight: 同时等待响应的请求数量上限，超过时 submit 会阻塞
+        """
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        self.__send = send
+        self.__send_lock = threading.Lock()
+        self.__counter = itertools.count(1)
+        self.__pending: Dict[str, concurrent.futures.Future] = {}
+        self.__window = threading.BoundedSemaphore(max_in_flight)
+        self.__error: Optional[BaseException] = None
+
+    @property
+    def in_flight(self) -> int:
+        """等待响应的请求数量"""
+        return len(self.__pending)
+
+    def submit(self, command: str, subcommand: Optional[str] = None, content=None,
+               timeout: Optional[float] = None) -> concurrent.futures.Future:
+        """发送请求，返回一个 Future；取消 Future 即取消等待
+        :param timeout: 等待发送窗口的超时时间，为空时使用默认值
+        """
+        if self.__error:
+            raise ConnectionError('websocket 连接已断开') from self.__error
+        if not self.__window.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise TimeoutError(f'等待发送 {command} 超时，已有 {self.in_flight} 个请求在等待响应')
+        sync_id = str(next(self.__counter))
+        future = concurrent.futures.Future()
+        self.__pending[sync_id] = future
+        future.add_done_callback(lambda _: self.__release(sync_id))
+        try:
+            with self.__send_lock:
+                self.__send(_dump_request(sync_id, command, subcommand, content))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def request(self, command: str, subcommand: Optional[str] = None, content=None,
+                timeout: Optional[float] = None):
+        """发送请求并等待响应
+        :param timeout: 超时时间，为空时使用默认值；超时后请求被取消并抛出 TimeoutError
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(command, subcommand, content, timeout)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f'{command} 在 {timeout} 秒内没有响应') from None
+
+    def resolve(self, sync_id: str, data) -> bool:
+        """收到响应时调用，返回是否有请求在等待该 syncId"""
+        future = self.__pending.get(sync_id, None)
+        if future is None:
+            return False
+        try:
+            future.set_result(data)
+        except Exception:
+            return False
+        return True
+
+    def fail_all(self, error: BaseException):
+        """连接断开时调用，使所有等待中的请求失败，并拒绝之后的请求"""
+        self.__error = error
+        for future in list(self.__pending.values()):
+            try:
+                future.set_exception(ConnectionError('websocket 连接已断开'))
+            except Exception:
+                pass
+
+    def __release(self, sync_id: str):
+        if self.__pending.pop(sync_id, None) is not None:
+            self.__window.release()
+
+
+class AsyncMultiplexer:
+    """Multiplexer 的 asyncio 版本，需要在事件循环中创建"""
+
+    def __init__(self, send: Callable[[str], Awaitable], timeout: float = 30., max_in_flight: int = 64):
+        """
+        :param send: 发送一段文本的协程函数
+        :param timeout: 默认的请求超时时间，单位为秒
+        :param max_in_flight: 同时等待响应的请求数量上限，超过时 request 会等待
+        """
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+
+        self.__send = send
+        self.__counter = itertools.count(1)
+        self.__pending: Dict[str, asyncio.Future] = {}
+        self.__window = asyncio.Semaphore(max_in_flight)
+        self.__error: Optional[BaseException] = None
+
+    @property
+    def in_flight(self) -> int:
+        """等待响应的请求数量"""
+        return len(self.__pending)
+
+    async def request(self, command: str, subcommand: Optional[str] = None, content=None,
+                      timeout: Optional[float] = None):
+        """发送请求并等待响应；超时后请求被取消并抛出 TimeoutError，取消调用者的任务同样会取消请求
+        :param timeout: 超时时间，为空时使用默认值，包括等待发送窗口的时间
+        """
+        if self.__error:
+            raise ConnectionError('websocket 连接已断开') from self.__error
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(self.__request(command, subcommand, content), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'{command} 在 {timeout} 秒内没有响应') from None
+
+    async def __request(self, command: str, subcommand: Optional[str], content):
+        async with self.__window:
+            sync_id = str(next(self.__counter))
+            future = asyncio.get_event_loop().create_future()
+            self.__pending[sync_id] = future
+            try:
+                await self.__send(_dump_request(sync_id, command, subcommand, content))
+                return await future
+            finally:
+                self.__pending.pop(sync_id, None)
+
+    def resolve(self, sync_id: str, data) -> bool:
+        """收到响应时调用，返回是否有请求在等待该 syncId"""
+        future = self.__pending.get(sync_id, None)
+        if future is None or future.done():
+            return False
+        future.set_result(data)
+        return True
+
+    def fail_all(self, error: BaseException):
+        """连接断开时调用，使所有等待中的请求失败，并拒绝之后的请求"""
+        self.__error = error
+        for future in list(self.__pending.values()):
+            if not future.done():
+                future.set_exception(ConnectionError('websocket 连接已断开'))
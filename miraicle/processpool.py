@@ -0,0 +1,120 @@
+import json
+import multiprocessing
+import os
+import pickle
+import threading
+from typing import Callable, Dict, Optional
+
+from .events import parse_event
+from .threadpool import ThreadPool
+from .utils import logger
+
+_bot: Optional['BotProxy'] = None
+_REGISTER = '__register__'
+
+
+class BotProxy:
+    """子进程中的 bot 代理：qq 与 session_key 可以直接读取，
+    调用其他公开方法时把调用发送回主进程，由主进程中的 bot 执行并返回结果"""
+
+    def __init__(self, qq: int, session_key: Optional[str], adapter: str, requests, replies):
+        self.qq: int = qq
+        self.session_key: Optional[str] = session_key
+        self.adapter: str = adapter
+        self.__requests = requests
+        self.__replies = replies
+        self.__pid = os.getpid()
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.__requests.put((self.__pid, name, args, kwargs))
+            ok, result = self.__replies.recv()
+            if not ok:
+                raise result
+            return result
+
+        call.__name__ = name
+        return call
+
+
+def _init_worker(qq: int, session_key: Optional[str], adapter: str, requests):
+    """子进程的初始化函数：创建接收结果的管道并把发送端登记到主进程，不会阻塞，
+    因此子进程意外退出后由进程池补充的新进程同样可以转发调用"""
+    global _bot
+    replies, sender = multiprocessing.Pipe(duplex=False)
+    requests.put((os.getpid(), _REGISTER, (sender,), {}))
+    _bot = BotProxy(qq, session_key, adapter, requests, replies)
+
+
+def _run_handler(func: Callable, payload: str):
+    func(_bot, parse_event(json.loads(payload), _bot.qq))
+
+
+class ProcessPool:
+    """在子进程中运行 CPU 密集的处理函数，绕开 GIL
+
+    原始消息以紧凑的 json 字符串传给子进程并在子进程中重新解析；处理函数收到的 bot 是 BotProxy，
+    它的 send_* 等方法调用会被转发回主进程，由主进程中已经连接的 bot 执行。
+    处理函数需要能被 pickle，即定义在模块顶层；参数与返回值同样需要能被 pickle。
+    子进程以 forkserver（不支持时为 spawn）方式启动，不继承主进程的线程与连接，
+    因此启动 bot 的代码需要放在 if __name__ == '__main__': 之下。
+    """
+
+    def __init__(self, bot, processes: Optional[int] = None):
+        """
+        :param bot: 主进程中的 bot
+        :param processes: 子进程数量，默认为 CPU 核数
+        """
+        self.processes: int = processes if processes else os.cpu_count() or 1
+
+        self.__bot = bot
+        self.__executor = ThreadPool(core_pool_size=1, max_pool_size=self.processes)
+        self.__replies: Dict[int, object] = {}
+        self.__closed = False
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.__requests = context.Queue()
+        self.__pool = context.Pool(self.processes, initializer=_init_worker,
+                                   initargs=(bot.qq, bot.session_key, bot.adapter, self.__requests))
+        threading.Thread(target=self.__serve, daemon=True).start()
+
+    def run(self, func: Callable, msg_origin: dict):
+        """在子进程中运行 func(bot, msg)，等待其结束；处理函数抛出的异常会在这里重新抛出
+        :param func: 处理函数
+        :param msg_origin: mirai-api-http 推送的原始消息或事件
+        """
+        payload = json.dumps(msg_origin, ensure_ascii=False, separators=(',', ':'))
+        self.__pool.apply(_run_handler, (func, payload))
+
+    def close(self):
+        """等待正在运行的处理函数结束后关闭子进程，可以重复调用"""
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__pool.close()
+        self.__pool.join()
+
+    def __serve(self):
+        """接收子进程的调用并执行；每个子进程同时只有一个调用，使用独立的线程池，
+        避免 bot 的线程池被等待子进程的处理函数占满时无法执行这些调用"""
+        while True:
+            pid, name, args, kwargs = self.__requests.get()
+            if name == _REGISTER:
+                self.__replies[pid] = args[0]
+                continue
+            self.__executor.add_task(target=self.__call, args=(pid, name, args, kwargs))
+
+    def __call(self, pid: int, name: str, args, kwargs):
+        try:
+            result = (True, getattr(self.__bot, name)(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            pickle.dumps(result)
+        except Exception:
+            logger.exception('%s 的结果无法传回子进程', name)
+            result = (False, RuntimeError(f'{name} 的结果无法传回子进程'))
+        self.__replies[pid].send(result)
@@ -0,0 +1,300 @@
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Awaitable, Dict, Deque, Hashable, List, Optional, Set, Tuple
+
+from .utils import cancel_tasks
+
+
+class TokenBucket:
+    """令牌桶：以 rate 的速率生成令牌，最多积累 burst 个"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        """
+        :param rate: 每秒生成的令牌数量
+        :param burst: 令牌数量上限
+        """
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+
+    def delay(self, now: float, factor: float = 1.) -> float:
+        """返回得到一个令牌还需要等待的秒数
+        :param factor: 生成速率的系数
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate * factor)
+        self.updated = now
+        return 0. if self.tokens >= 1 else (1 - self.tokens) / (self.rate * factor)
+
+    def take(self):
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        return self.tokens >= self.burst
+
+
+MERGEABLE_TYPES = frozenset(('Plain', 'At', 'AtAll', 'Face', 'Image'))
+
+
+class SendItem:
+    """发送队列中的一次 API 调用，合并后可能对应多个调用者的 Future；
+    每个调用者的消息单独保存，发送前丢弃已取消的调用者的消息"""
+
+    __slots__ = ('target', 'command', 'parts', 'ready_at')
+
+    def __init__(self, target: Hashable, command: str, content: dict, future, ready_at: float = 0.):
+        self.target = target
+        self.command = command
+        self.parts: List[Tuple[Any, dict]] = [(future, content)]
+        self.ready_at: float = ready_at
+
+    @property
+    def futures(self) -> list:
+        return [future for future, _ in self.parts]
+
+    @property
+    def content(self) -> dict:
+        """合并后的请求内容：以第一个调用者的请求为准，消息链依次连接"""
+        content = self.parts[0][1]
+        if len(self.parts) == 1:
+            return content
+        return dict(content, messageChain=[ele for _, part in self.parts for ele in part['messageChain']])
+
+    def merge(self, other: 'SendItem') -> bool:
+        """将 other 的消息链接在本条消息之后，返回是否合并成功；
+        只有同一目标、同一命令、都只包含普通元素且 other 没有引用回复的消息才能合并"""
+        if other.command != self.command or 'quote' in other.content:
+            return False
+        chain = self.parts[0][1].get('messageChain', None)
+        other_chain = other.content.get('messageChain', None)
+        if chain is None or other_chain is None:
+            return False
+        if not all(ele.get('type', None) in MERGEABLE_TYPES for ele in chain + other_chain):
+            return False
+        self.parts.extend(other.parts)
+        return True
+
+    def keep(self, alive: Callable[[Any], bool]) -> bool:
+        """丢弃 alive 返回 False 的调用者的消息，返回是否还有需要发送的消息
+        :param alive: 以 Future 为参数，判断调用者是否仍在等待结果
+        """
+        self.parts = [(future, content) for future, content in self.parts if alive(future)]
+        return bool(self.parts)
+
+
+class SendLimiter:
+    """出站消息的调度策略：每个发送目标与全局各有一个令牌桶，
+    不同目标的消息轮流发送，一个目标的消息积压不会阻塞其他目标；
+    发送失败时所有令牌桶的速率减半，之后每次成功缓慢恢复（AIMD）；
+    设置 coalesce 后，同一目标在 coalesce 秒内排队的消息会被合并为一条发送"""
+
+    def __init__(self, rate: float = 1., burst: float = 3, global_rate: float = 10., global_burst: float = 10,
+                 backoff: float = 0.5, recovery: float = 0.05, min_factor: float = 0.05, max_buckets: int = 4096,
+                 coalesce: float = 0.):
+        """
+        :param rate: 每个目标每秒发送的消息数量
+        :param burst: 每个目标允许连续发送的消息数量
+        :param global_rate: 全局每秒发送的消息数量
+        :param global_burst: 全局允许连续发送的消息数量
+        :param backoff: 发送失败时速率乘以的系数
+        :param recovery: 发送成功时速率系数增加的量
+        :param min_factor: 速率系数的下限
+        :param max_buckets: 令牌桶数量超过该值时清理已经回满且空闲的令牌桶
+        :param coalesce: 合并窗口，单位为秒，为 0 时不合并
+        """
+        self.rate = rate
+        self.burst = burst
+        self.backoff = backoff
+        self.recovery = recovery
+        self.min_factor = min_factor
+        self.max_buckets = max_buckets
+        self.coalesce = coalesce
+        self.factor: float = 1.
+
+        self.__global = TokenBucket(global_rate, global_burst)
+        self.__buckets: Dict[Hashable, TokenBucket] = {}
+        self.__lanes: Dict[Hashable, Deque[SendItem]] = collections.OrderedDict()
+
+    @property
+    def pending(self) -> int:
+        """等待发送的消息数量"""
+        return sum(len(lane) for lane in self.__lanes.values())
+
+    def push(self, item: SendItem, now: Optional[float] = None):
+        lane = self.__lanes.get(item.target, None)
+        if lane is None:
+            lane = self.__lanes[item.target] = collections.deque()
+        if self.coalesce > 0:
+            now = time.monotonic() if now is None else now
+            if lane and lane[-1].ready_at > now and lane[-1].merge(item):
+                return
+            item.ready_at = now + self.coalesce
+        lane.append(item)
+
+    def poll(self, now: float) -> Tuple[Optional[SendItem], Optional[float]]:
+        """取出下一条可以发送的消息
+        :return: (消息, 0)，或 (None, 需要等待的秒数)；没有等待发送的消息时等待时间为 None
+        """
+        if not self.__lanes:
+            return None, None
+        wait = self.__global.delay(now, self.factor)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for target, lane in list(self.__lanes.items()):
+            bucket = self.__bucket(target)
+            delay = max(bucket.delay(now, self.factor), lane[0].ready_at - now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            lane = self.__lanes.pop(target)
+            item = lane.popleft()
+            if lane:
+                self.__lanes[target] = lane
+            bucket.take()
+            self.__global.take()
+            return item, 0.
+        return None, wait
+
+    def feedback(self, ok: bool):
+        """记录一次发送的结果，调整发送速率"""
+        if ok:
+            self.factor = min(1., self.factor + self.recovery)
+        else:
+            self.factor = max(self.min_factor, self.factor * self.backoff)
+
+    def __bucket(self, target: Hashable) -> TokenBucket:
+        bucket = self.__buckets.get(target, None)
+        if bucket is None:
+            if len(self.__buckets) >= self.max_buckets:
+                self.__buckets = {t: b for t, b in self.__buckets.items() if t in self.__lanes or not b.full}
+            bucket = self.__buckets[target] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+
+def is_success(response) -> bool:
+    """mirai-api-http 的响应是否表示发送成功"""
+    return isinstance(response, dict) and response.get('code', 0) == 0
+
+
+class SendQueue:
+    """Mirai 的出站消息队列，由一个后台线程按 SendLimiter 的策略依次发送"""
+
+    def __init__(self, send: Callable[[str, dict], dict], limiter: SendLimiter):
+        """
+        :param send: 实际发送的函数，参数为命令与请求内容，返回 mirai-api-http 的响应
+        :param limiter: 调度策略
+        """
+        self.limiter = limiter
+
+        self.__send = send
+        self.__condition = threading.Condition()
+        self.__thread: Optional[threading.Thread] = None
+
+    def submit(self, target: Hashable, command: str, content: dict) -> concurrent.futures.Future:
+        """将消息放入队列
+        :param target: 发送目标，如 ('group', 群号)
+        :return: 结果为 mirai-api-http 响应的 Future
+        """
+        future = concurrent.futures.Future()
+        with self.__condition:
+            self.limiter.push(SendItem(target, command, content, future))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__send_loop, daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+        return future
+
+    def __send_loop(self):
+        while True:
+            with self.__condition:
+                item, wait = self.limiter.poll(time.monotonic())
+                if item is None:
+                    self.__condition.wait(wait)
+                    continue
+            if not item.keep(lambda future: future.set_running_or_notify_cancel()):
+                continue
+            futures = item.futures
+            try:
+                response = self.__send(item.command, item.content)
+            except BaseException as e:
+                ok = False
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                ok = is_success(response)
+                for future in futures:
+                    future.set_result(response)
+            with self.__condition:
+                self.limiter.feedback(ok)
+
+
+class AsyncSendQueue:
+    """AsyncMirai 的出站消息队列，按 SendLimiter 的策略为每条消息创建发送任务"""
+
+    def __init__(self, send: Callable[[str, dict], Awaitable[dict]], limiter: SendLimiter):
+        """
+        :param send: 实际发送的协程函数，参数为命令与请求内容，返回 mirai-api-http 的响应
+        :param limiter: 调度策略
+        """
+        self.limiter = limiter
+
+        self.__send = send
+        self.__wakeup: Optional[asyncio.Event] = None
+        self.__task: Optional[asyncio.Task] = None
+        self.__sending: Set[asyncio.Task] = set()
+
+    async def send(self, target: Hashable, command: str, content: dict) -> dict:
+        """将消息放入队列并等待发送结果
+        :param target: 发送目标，如 ('group', 群号)
+        :return: mirai-api-http 的响应
+        """
+        loop = asyncio.get_event_loop()
+        if self.__task is None:
+            self.__wakeup = asyncio.Event()
+            self.__task = loop.create_task(self.__send_loop())
+        future = loop.create_future()
+        self.limiter.push(SendItem(target, command, content, future))
+        self.__wakeup.set()
+        return await future
+
+    async def close(self):
+        """取消发送任务并等待它们结束；队列中尚未发送的消息保留，下次调用 send 时继续发送"""
+        if self.__task is not None:
+            await cancel_tasks([self.__task, *self.__sending])
+            self.__task = None
+
+    async def __send_loop(self):
+        while True:
+            item, wait = self.limiter.poll(time.monotonic())
+            if item is None:
+                self.__wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if item.keep(lambda future: not future.cancelled()):
+                task = asyncio.get_event_loop().create_task(self.__send_item(item))
+                self.__sending.add(task)
+                task.add_done_callback(self.__sending.discard)
+
+    async def __send_item(self, item: SendItem):
+        try:
+            response = await self.__send(item.command, item.content)
+        except Exception as e:
+            self.limiter.feedback(False)
+            for future in item.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.limiter.feedback(is_success(response))
+        for future in item.futures:
+            if not future.done():
+                future.set_result(response)
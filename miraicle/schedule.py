@@ -7,35 +7,214 @@
     @miraicle.scheduled_job(miraicle.Scheduler.every().hour.at(':12:34'))
     @miraicle.scheduled_job(miraicle.Scheduler.every().day.at('20'))
     @miraicle.scheduled_job(miraicle.Scheduler.every().sunday.at('11:45:14'))
+
+运行时添加、取消与重新安排任务：
+    job = miraicle.Scheduler.add_job(miraicle.Scheduler.every(30).minutes, func)
+    miraicle.Scheduler.reschedule_job(job, miraicle.Scheduler.every().hour.at(':00:00'))
+    miraicle.Scheduler.cancel_job(job)
 """
 
 import datetime
 import calendar
 import warnings
-from typing import List, Optional
+import threading
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Optional, Callable
+
+from .utils import logger
 
 
 class Scheduler:
+    """定时任务调度器，任务按下次运行的单调时钟时间保存在堆中，调度线程只在最早的任务到期时被唤醒；
+    系统时间被调整时不会提前或推迟运行任务；jobs 为调度中的任务列表，取消任务时以末尾的任务填补空位，不保持添加顺序"""
+
     jobs: List['Job'] = []
+    max_sleep: float = 60.
+
+    __heap: List[list] = []
+    __counter = itertools.count()
+    __cancelled = 0
+    __condition = threading.Condition(threading.RLock())
+    __wakers: List[Callable] = []
 
     @staticmethod
     def every(interval: int = 1):
         job = Job(interval)
         return job
 
-    def run(self, bot):
-        for job in self.jobs:
-            if job.time_up():
+    @classmethod
+    def add_job(cls, job: 'Job', func: Callable) -> 'Job':
+        """添加定时任务，可在运行时调用
+        :param job: 由 Scheduler.every 创建的任务
+        :param func: 任务到期时调用的函数，参数为 bot
+        :return: 添加的任务，可用于 cancel_job 与 reschedule_job
+        """
+        with cls.__condition:
+            if job._entry is not None:
+                cls.cancel_job(job)
+            job.initialize(func)
+            if job._index is None:
+                job._index = len(cls.jobs)
+                cls.jobs.append(job)
+            cls.__push(job)
+        return job
+
+    @classmethod
+    def cancel_job(cls, job: 'Job') -> bool:
+        """取消定时任务
+        :param job: 要取消的任务
+        :return: 任务取消前是否处于调度中
+        """
+        with cls.__condition:
+            if job._cancelled:
+                return False
+            job._cancelled = True
+            if job._index is not None:
+                last = cls.jobs.pop()
+                if last is not job:
+                    cls.jobs[job._index] = last
+                    last._index = job._index
+                job._index = None
+            if job._entry is not None:
+                job._entry[-1] = None
+                job._entry = None
+                cls.__cancelled += 1
+                if cls.__cancelled > len(cls.__heap) // 2:
+                    cls.__heap[:] = [entry for entry in cls.__heap if entry[-1] is not None]
+                    heapq.heapify(cls.__heap)
+                    cls.__cancelled = 0
+        return True
+
+    @classmethod
+    def reschedule_job(cls, job: 'Job', trigger: Optional['Job'] = None) -> 'Job':
+        """重新安排定时任务
+        :param job: 要重新安排的任务
+        :param trigger: 新的运行规则，如 Scheduler.every(5).minutes；为空时按原规则重新计算下次运行时间
+        :return: 重新安排后的任务
+        """
+        cls.cancel_job(job)
+        if trigger:
+            job.interval = trigger.interval
+            job.unit = trigger.unit
+            job.start_day = trigger.start_day
+            job.at_time = trigger.at_time
+        return cls.add_job(job, job.func)
+
+    @classmethod
+    def __push(cls, job: 'Job'):
+        with cls.__condition:
+            job._cancelled = False
+            entry = [job._deadline, next(cls.__counter), job]
+            job._entry = entry
+            heapq.heappush(cls.__heap, entry)
+            cls.__condition.notify_all()
+            wakers = list(cls.__wakers)
+        for waker in wakers:
+            waker()
+
+    @classmethod
+    def __pop_due(cls) -> Optional['Job']:
+        with cls.__condition:
+            cls.__drop_cancelled()
+            if cls.__heap and cls.__heap[0][-1].time_up():
+                job = heapq.heappop(cls.__heap)[-1]
+                job._entry = None
+                return job
+        return None
+
+    @classmethod
+    def __requeue(cls, job: 'Job'):
+        with cls.__condition:
+            if job._cancelled or job._entry is not None:
+                return
+            job.update_time()
+            cls.__push(job)
+
+    @classmethod
+    def __drop_cancelled(cls):
+        while cls.__heap and cls.__heap[0][-1] is None:
+            heapq.heappop(cls.__heap)
+            cls.__cancelled -= 1
+
+    @classmethod
+    def __delay(cls) -> float:
+        """距离最早的任务到期的秒数"""
+        with cls.__condition:
+            cls.__drop_cancelled()
+            if not cls.__heap:
+                return cls.max_sleep
+            delay = cls.__heap[0][0] - time.monotonic()
+        return min(max(delay, 0.), cls.max_sleep)
+
+    def run(self, bot) -> float:
+        """运行所有已到期的任务
+        :return: 距离下一个任务到期的秒数
+        """
+        while True:
+            job = self.__pop_due()
+            if job is None:
+                break
+            try:
                 if job.time_unexpired():
                     job.execute(bot)
-                job.update_time()
-
-    async def async_run(self, bot):
-        for job in self.jobs:
-            if job.time_up():
+            except Exception:
+                logger.exception('定时任务 %s 运行失败', job)
+            finally:
+                self.__requeue(job)
+        return self.__delay()
+
+    async def async_run(self, bot) -> float:
+        """运行所有已到期的任务
+        :return: 距离下一个任务到期的秒数
+        """
+        while True:
+            job = self.__pop_due()
+            if job is None:
+                break
+            try:
                 if job.time_unexpired():
                     await job.async_execute(bot)
-                job.update_time()
+            except Exception:
+                logger.exception('定时任务 %s 运行失败', job)
+            finally:
+                self.__requeue(job)
+        return self.__delay()
+
+    def run_forever(self, bot):
+        """持续运行任务，在最早的任务到期或有新任务加入时被唤醒"""
+        while True:
+            self.run(bot)
+            with self.__condition:
+                delay = self.__delay()
+                if delay > 0:
+                    self.__condition.wait(delay)
+
+    async def async_run_forever(self, bot):
+        """持续运行任务，在最早的任务到期或有新任务加入时被唤醒"""
+        loop = asyncio.get_event_loop()
+        wakeup = asyncio.Event()
+
+        def waker():
+            loop.call_soon_threadsafe(wakeup.set)
+
+        with self.__condition:
+            self.__wakers.append(waker)
+        try:
+            while True:
+                await self.async_run(bot)
+                wakeup.clear()
+                delay = self.__delay()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            with self.__condition:
+                self.__wakers.remove(waker)
 
 
 class Job:
@@ -48,15 +227,19 @@ class Job:
         self.func = None
         self.last_run: Optional[datetime.datetime] = None
         self.next_run: Optional[datetime.datetime] = None
+        self._deadline: Optional[float] = None
+        self._entry: Optional[list] = None
+        self._index: Optional[int] = None
+        self._cancelled: bool = False
 
     def __repr__(self):
         return f'<Job:{self.func} | {self.interval} {self.unit} | last {self.last_run} | next {self.next_run}>'
 
     def time_up(self):
-        return self.next_run < datetime.datetime.now()
+        return self._deadline <= time.monotonic()
 
     def time_unexpired(self):
-        return datetime.datetime.now() < self.next_run + datetime.timedelta(minutes=1)
+        return time.monotonic() < self._deadline + 60
 
     def execute(self, bot):
         self.func(bot)
@@ -207,14 +390,20 @@ class Job:
                 next_run = next_run.replace(hour=self.at_time.hour,
                                             minute=self.at_time.minute,
                                             second=self.at_time.second)
-        while next_run < datetime.datetime.now():
+        now = datetime.datetime.now()
+        while next_run < now:
             next_run = self.__calculate_next(next_run)
         self.next_run = next_run
+        self._deadline = time.monotonic() + (next_run - now).total_seconds()
 
     def update_time(self):
+        """按运行规则推进到下一个未到期的时间；推进在单调时钟上进行，next_run 只用于显示"""
         self.last_run = self.next_run
-        while self.next_run < datetime.datetime.now():
-            self.next_run = self.__calculate_next(self.last_run)
+        now = time.monotonic()
+        while self._deadline <= now:
+            following = self.__calculate_next(self.next_run)
+            self._deadline += (following - self.next_run).total_seconds()
+            self.next_run = following
 
     def __calculate_next(self, time):
         return time + datetime.timedelta(**{self.unit: self.interval})
@@ -222,8 +411,7 @@ class Job:
 
 def scheduled_job(job: Job):
     def wrapper(func):
-        job.initialize(func)
-        Scheduler.jobs.append(job)
+        Scheduler.add_job(job, func)
         return func
 
     return wrapper
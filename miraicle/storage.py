@@ -0,0 +1,196 @@
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from typing import Optional, Set
+
+from .utils import logger
+
+_stores: 'weakref.WeakSet[ConfigStore]' = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_stores():
+    """退出时写入所有 ConfigStore 尚未写入的修改"""
+    for store in list(_stores):
+        try:
+            store.flush()
+        except Exception as e:
+            logger.error('ConfigStore: failed to write %s: %s: %s', store.path, e.__class__.__name__, e)
+
+
+class ConfigStore:
+    """json 配置文件的后台写入器
+
+    save 只记录被修改的顶层键并唤醒写入线程，不进行任何磁盘 I/O；
+    写入线程合并 flush_interval 秒内的所有修改，写入临时文件后原子地替换配置文件。
+    开启 journal 后，每次写入只向追加日志写入被修改的顶层键及其完整的值，
+    日志记录数超过 compact_threshold 或日志大小超过配置文件的 compact_ratio 倍时再把完整配置压缩进配置文件。
+    """
+
+    min_journal_bytes: int = 1 << 16
+
+    def __init__(self, path: str, lock: Optional[threading.Lock] = None, flush_interval: float = 1.,
+                 journal: bool = False, compact_threshold: int = 1000, compact_ratio: float = 1.):
+        """
+        :param path: 配置文件路径
+        :param lock: 修改配置时持有的锁，写入线程在生成快照时持有该锁
+        :param flush_interval: 两次写入之间的最长间隔，进程崩溃时最多丢失这段时间内的修改
+        :param journal: 是否使用追加日志
+        :param compact_threshold: 日志记录数超过该值时压缩日志
+        :param compact_ratio: 日志大小超过配置文件大小的该倍数（至少 min_journal_bytes 字节）时压缩日志，
+            避免较大的键被频繁修改时日志无限增长
+        """
+        self.path = path
+        self.journal_path = f'{path}.journal'
+        self.lock = lock if lock else threading.Lock()
+        self.flush_interval = flush_interval
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self.compact_ratio = compact_ratio
+
+        self.__config: Optional[dict] = None
+        self.__dirty_keys: Set[str] = set()
+        self.__dirty_all: bool = False
+        self.__journal_records: int = 0
+        self.__journal_bytes: int = 0
+        self.__snapshot_bytes: int = 0
+        self.__condition = threading.Condition()
+        self.__flush_lock = threading.Lock()
+        self.__thread: Optional[threading.Thread] = None
+        _stores.add(self)
+
+    def load(self) -> dict:
+        """读取配置文件，并回放追加日志中尚未压缩的修改"""
+        config = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            self.__snapshot_bytes = os.path.getsize(self.path)
+        for journal_path in (f'{self.journal_path}.compacting', self.journal_path):
+            if not os.path.exists(journal_path):
+                continue
+            self.__journal_bytes += os.path.getsize(journal_path)
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的记录
+                        continue
+                    if 'value' in record:
+                        config[record['key']] = record['value']
+                    else:
+                        config.pop(record['key'], None)
+                    self.__journal_records += 1
+        return config
+
+    def save(self, config: dict, *keys: str):
+        """标记配置需要写入，不阻塞调用者
+        :param config: 配置字典
+        :param keys: 被修改的顶层键，为空时写入完整配置
+        """
+        with self.__condition:
+            self.__config = config
+            if keys and self.journal:
+                self.__dirty_keys.update(keys)
+            else:
+                self.__dirty_all = True
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__write_loop, daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+    def flush(self):
+        """立即写入所有尚未写入的修改"""
+        with self.__flush_lock:
+            with self.__condition:
+                config = self.__config
+                keys, self.__dirty_keys = self.__dirty_keys, set()
+                dirty_all, self.__dirty_all = self.__dirty_all, False
+            if config is None or not (keys or dirty_all):
+                return
+            try:
+                with self.lock:
+                    records = [json.dumps({'key': key, 'value': config[key]} if key in config else {'key': key},
+                                          ensure_ascii=False)
+                               for key in keys]
+                    data = ''.join(f'{record}\n' for record in records).encode('utf-8')
+                    compact = (dirty_all
+                               or self.__journal_records + len(records) > self.compact_threshold
+                               or self.__journal_bytes + len(data) > max(self.__snapshot_bytes * self.compact_ratio,
+                                                                         self.min_journal_bytes))
+                    snapshot = json.dumps(config, ensure_ascii=False, indent=4) if compact else None
+                if compact:
+                    self.__compact(snapshot.encode('utf-8'))
+                else:
+                    self.__append_journal(data, len(records))
+            except BaseException:
+                # 写入失败时恢复修改标记，下一次写入时重试
+                with self.__condition:
+                    self.__dirty_keys.update(keys)
+                    self.__dirty_all = self.__dirty_all or dirty_all
+                raise
+
+    def __write_loop(self):
+        while True:
+            with self.__condition:
+                while not (self.__dirty_keys or self.__dirty_all):
+                    self.__condition.wait()
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('ConfigStore: failed to write %s: %s: %s', self.path, e.__class__.__name__, e)
+
+    def __append_journal(self, data: bytes, records: int):
+        with open(self.journal_path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.__journal_records += records
+        self.__journal_bytes += len(data)
+
+    def __compact(self, snapshot: bytes):
+        """原子地写入完整配置；在替换配置文件之前先将日志改名，崩溃后回放日志仍能得到一致的配置；
+        上次压缩中断时留下的日志会与当前日志按顺序合并，而不是被覆盖"""
+        compacting_path = f'{self.journal_path}.compacting'
+        if os.path.exists(self.journal_path):
+            if os.path.exists(compacting_path):
+                self.__merge_journal(compacting_path)
+            else:
+                os.replace(self.journal_path, compacting_path)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if os.path.exists(compacting_path):
+            os.remove(compacting_path)
+        self.__journal_records = 0
+        self.__journal_bytes = 0
+        self.__snapshot_bytes = len(snapshot)
+
+    def __merge_journal(self, compacting_path: str):
+        """将当前日志追加到上次中断的压缩留下的日志之后，再删除当前日志"""
+        with open(compacting_path, 'rb+') as dst:
+            dst.seek(0, os.SEEK_END)
+            if dst.tell():
+                dst.seek(-1, os.SEEK_END)
+                if dst.read(1) != b'\n':
+                    dst.write(b'\n')
+            with open(self.journal_path, 'rb') as src:
+                shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(self.journal_path)
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+from typing import Callable, Optional, Dict, Set, Deque, Tuple, Hashable
+
+from .utils import logger, cancel_tasks
+
+
+class TaskSupervisor:
+    """AsyncMirai 的任务管理器：限制全局与单个处理函数的并发数量，
+    等待中的任务数量达到上限时 submit 会等待，从而把压力传回接收循环；
+    任务抛出的异常会被收集并交给 on_error 处理"""
+
+    def __init__(self, max_running: int = 256, max_per_handler: int = 16, max_pending: int = 1024,
+                 on_error: Optional[Callable[[BaseException, Callable], None]] = None, max_errors: int = 100):
+        """
+        :param max_running: 同时运行的任务数量上限
+        :param max_per_handler: 同一个处理函数同时运行的任务数量上限
+        :param max_pending: 等待运行的任务数量上限
+        :param on_error: 任务抛出异常时调用，参数为异常与处理函数，默认打印异常信息
+        :param max_errors: errors 中保留的异常数量
+        """
+        self.max_running = max_running
+        self.max_per_handler = max_per_handler
+        self.max_pending = max_pending
+        self.on_error = on_error if on_error else self.__print_error
+        self.errors: Deque[Tuple[BaseException, Callable]] = collections.deque(maxlen=max_errors)
+
+        self.__running = 0
+        self.__queued = 0
+        self.__tasks: Set[asyncio.Task] = set()
+        self.__capacity: Optional[asyncio.Semaphore] = None
+        self.__slots: Optional[asyncio.Semaphore] = None
+        self.__handler_slots: Dict[object, asyncio.Semaphore] = {}
+        self.__lanes: Dict[Hashable, Deque[Tuple[Callable, tuple]]] = {}
+
+    @property
+    def running(self) -> int:
+        """正在运行的任务数量"""
+        return self.__running
+
+    @property
+    def queued(self) -> int:
+        """等待运行的任务数量"""
+        return self.__queued
+
+    async def submit(self, func: Callable, *args, key=None) -> asyncio.Task:
+        """创建运行 func(*args) 的任务，任务数量达到上限时等待
+        :param key: 并发限制的分组，默认为 func
+        """
+        await self.__reserve()
+        return self.__create_task(self.__run(func, args, func if key is None else key))
+
+    async def submit_ordered(self, order_key: Hashable, func: Callable, *args):
+        """与 submit 相同，但 order_key 相同的任务按提交顺序依次运行
+        :param order_key: 顺序键，如群号或 QQ 号
+        """
+        await self.__reserve()
+        lane = self.__lanes.get(order_key, None)
+        if lane is not None:
+            lane.append((func, args))
+            return
+        self.__lanes[order_key] = collections.deque([(func, args)])
+        self.__create_task(self.__drain(order_key))
+
+    async def __reserve(self):
+        if self.__capacity is None:
+            self.__capacity = asyncio.Semaphore(self.max_running + self.max_pending)
+            self.__slots = asyncio.Semaphore(self.max_running)
+        await self.__capacity.acquire()
+        self.__queued += 1
+
+    def __create_task(self, coro) -> asyncio.Task:
+        task = asyncio.get_event_loop().create_task(coro)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    async def __drain(self, order_key: Hashable):
+        lane = self.__lanes[order_key]
+        try:
+            while lane:
+                func, args = lane.popleft()
+                await self.__run(func, args, func)
+        finally:
+            del self.__lanes[order_key]
+            for _ in lane:
+                self.__queued -= 1
+                self.__capacity.release()
+
+    async def join(self):
+        """等待所有已提交的任务结束"""
+        while self.__tasks:
+            await asyncio.wait(list(self.__tasks))
+
+    async def cancel(self):
+        """取消所有已提交的任务并等待它们结束"""
+        await cancel_tasks(list(self.__tasks))
+
+    async def __run(self, func: Callable, args, key):
+        started = False
+        try:
+            handler_slots = self.__handler_slots.get(key, None)
+            if handler_slots is None:
+                handler_slots = self.__handler_slots[key] = asyncio.Semaphore(self.max_per_handler)
+            async with handler_slots:
+                async with self.__slots:
+                    self.__queued -= 1
+                    self.__running += 1
+                    started = True
+                    try:
+                        await func(*args)
+                    except Exception as e:
+                        self.errors.append((e, func))
+                        self.on_error(e, func)
+                    finally:
+                        self.__running -= 1
+        finally:
+            if not started:
+                self.__queued -= 1
+            self.__capacity.release()
+
+    @staticmethod
+    def __print_error(error: BaseException, func: Callable):
+        name = getattr(func, '__qualname__', repr(func))
+        logger.error("handler '%s' raised an error: %s", name, error.__class__.__name__,
+                     exc_info=(type(error), error, error.__traceback__))
@@ -1,42 +1,183 @@
 import threading
 import queue
-import contextlib
-from typing import List, Tuple, Callable
+import collections
+import concurrent.futures
+import time
+from typing import Tuple, Callable, Dict, Deque, Hashable
+
+from .utils import logger
 
 
 class ThreadPool:
-    def __init__(self, core_pool_size: int = 0, max_pool_size: int = 16, timeout: float = 60.):
+    """有界线程池：核心线程常驻，超出核心数量的线程空闲 timeout 秒后退出；
+    任务队列已满时按 rejection 的策略处理新任务：
+        'block' 等待队列空出位置，
+        'drop_oldest' 取消队列中最早的任务，
+        'caller_runs' 在提交任务的线程中直接运行"""
+
+    def __init__(self, core_pool_size: int = 4, max_pool_size: int = 16, timeout: float = 60.,
+                 max_queue_size: int = 1024, rejection: str = 'block'):
+        """
+        :param core_pool_size: 核心线程数量
+        :param max_pool_size: 最大线程数量
+        :param timeout: 非核心线程的最长空闲时间，单位为秒
+        :param max_queue_size: 任务队列长度上限，0 表示不限
+        :param rejection: 队列已满时的策略，'block'、'drop_oldest' 或 'caller_runs'
+        """
+        if rejection not in ('block', 'drop_oldest', 'caller_runs'):
+            raise ValueError(f'unknown rejection policy: {rejection}')
         self.core_pool_size: int = core_pool_size
         self.max_pool_size: int = max_pool_size
         self.timeout: float = timeout
+        self.rejection: str = rejection
 
-        self.__queue: queue.Queue = queue.Queue()
-        self.__threads: List[str] = []
-        self.__free_threads: List[str] = []
+        self.__queue: queue.Queue = queue.Queue(max_queue_size)
+        self.__lock = threading.Lock()
+        self.__threads: int = 0
+        self.__idle: int = 0
+        self.__active: int = 0
+        self.__counters: Dict[str, float] = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                                             'caller_runs': 0, 'wait_time': 0., 'max_wait_time': 0.,
+                                             'run_time': 0., 'max_run_time': 0.}
 
-    def add_task(self, target: Callable, args: Tuple = ()):
-        self.__queue.put((target, args))
-        if not self.__free_threads and len(self.__threads) < self.max_pool_size:
-            new_thread = threading.Thread(target=self.__call)
-            new_thread.start()
-
-    def __call(self):
-        current_thread = threading.currentThread().getName()
-        with self.__worker_state(self.__threads, current_thread):
+    def submit(self, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """提交任务
+        :return: 任务的 Future
+        """
+        future = concurrent.futures.Future()
+        item = (future, fn, args, kwargs, time.monotonic())
+        with self.__lock:
+            self.__counters['submitted'] += 1
+            if self.__threads < self.max_pool_size and self.__queue.qsize() >= self.__idle:
+                self.__threads += 1
+                self.__idle += 1
+                threading.Thread(target=self.__worker, daemon=True).start()
+        if self.rejection == 'block':
+            self.__queue.put(item)
+        elif self.rejection == 'caller_runs':
+            try:
+                self.__queue.put_nowait(item)
+            except queue.Full:
+                with self.__lock:
+                    self.__counters['caller_runs'] += 1
+                self.__run(item)
+        else:
             while True:
                 try:
-                    with self.__worker_state(self.__free_threads, current_thread):
-                        func, args = self.__queue.get(timeout=self.timeout)
-                    func(*args)
-                except queue.Empty:
-                    if len(self.__threads) > self.core_pool_size:
-                        break
+                    self.__queue.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        dropped = self.__queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    dropped[0].cancel()
+                    with self.__lock:
+                        self.__counters['rejected'] += 1
+        return future
 
-    @staticmethod
-    @contextlib.contextmanager
-    def __worker_state(thread_list: List[str], thread_name: str):
-        thread_list.append(thread_name)
+    def add_task(self, target: Callable, args: Tuple = ()) -> concurrent.futures.Future:
+        """提交任务，任务抛出的异常会被打印
+        :return: 任务的 Future
+        """
+        future = self.submit(target, *args)
+        future.add_done_callback(self.__print_exception)
+        return future
+
+    def metrics(self) -> Dict[str, float]:
+        """返回线程池的运行指标，时间单位为秒"""
+        with self.__lock:
+            metrics = dict(self.__counters)
+            metrics.update(pool_size=self.__threads, active_workers=self.__active,
+                           idle_workers=self.__idle, queue_size=self.__queue.qsize())
+        finished = metrics['completed'] + metrics['failed']
+        metrics['avg_wait_time'] = metrics['wait_time'] / finished if finished else 0.
+        metrics['avg_run_time'] = metrics['run_time'] / finished if finished else 0.
+        return metrics
+
+    def __worker(self):
+        while True:
+            try:
+                item = self.__queue.get(timeout=self.timeout)
+            except queue.Empty:
+                with self.__lock:
+                    if self.__threads > self.core_pool_size:
+                        self.__threads -= 1
+                        self.__idle -= 1
+                        return
+                continue
+            with self.__lock:
+                self.__idle -= 1
+                self.__active += 1
+            try:
+                self.__run(item)
+            finally:
+                with self.__lock:
+                    self.__active -= 1
+                    self.__idle += 1
+
+    def __run(self, item):
+        future, fn, args, kwargs, submitted_at = item
+        if not future.set_running_or_notify_cancel():
+            return
+        started_at = time.monotonic()
         try:
-            yield
-        finally:
-            thread_list.remove(thread_name)
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            failed = True
+        else:
+            future.set_result(result)
+            failed = False
+        finished_at = time.monotonic()
+        with self.__lock:
+            counters = self.__counters
+            counters['failed' if failed else 'completed'] += 1
+            counters['wait_time'] += started_at - submitted_at
+            counters['max_wait_time'] = max(counters['max_wait_time'], started_at - submitted_at)
+            counters['run_time'] += finished_at - started_at
+            counters['max_run_time'] = max(counters['max_run_time'], finished_at - started_at)
+
+    @staticmethod
+    def __print_exception(future: concurrent.futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            error = future.exception()
+            logger.error('task raised an error: %s', error.__class__.__name__,
+                         exc_info=(type(error), error, error.__traceback__))
+
+
+class KeyedExecutor:
+    """按键串行执行任务：键相同的任务按提交顺序依次执行，键不同的任务在线程池中并行执行"""
+
+    def __init__(self, pool: ThreadPool):
+        self.__pool = pool
+        self.__lock = threading.Lock()
+        self.__lanes: Dict[Hashable, Deque[Tuple[Callable, Tuple]]] = {}
+
+    def add_task(self, key: Hashable, target: Callable, args: Tuple = ()):
+        with self.__lock:
+            lane = self.__lanes.get(key, None)
+            if lane is not None:
+                lane.append((target, args))
+                return
+            self.__lanes[key] = collections.deque([(target, args)])
+        future = self.__pool.add_task(target=self.__drain, args=(key,))
+        future.add_done_callback(lambda f: self.__discard(key) if f.cancelled() else None)
+
+    def __discard(self, key: Hashable):
+        """线程池丢弃了排空任务时，丢弃整条队列，之后同一个键的任务重新开始排队"""
+        with self.__lock:
+            self.__lanes.pop(key, None)
+
+    def __drain(self, key: Hashable):
+        while True:
+            with self.__lock:
+                lane = self.__lanes[key]
+                if not lane:
+                    del self.__lanes[key]
+                    return
+                target, args = lane.popleft()
+            try:
+                target(*args)
+            except Exception:
+                logger.exception('task raised an error')
@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class HttpTransport:
+    """Mirai 的 http 传输层：所有请求共用一个连接池并保持长连接，每个接口可以单独设置超时；
+    只有幂等的 GET 请求会在连接失败或超时后以带随机抖动的指数退避重试"""
+
+    timeouts: Dict[str, Timeout] = {'fetchMessage': (3.05, 10.),
+                                    'uploadImage': (3.05, 120.),
+                                    'uploadVoice': (3.05, 120.),
+                                    'uploadFileAndSend': (3.05, 600.)}
+    no_retry = frozenset(('fetchMessage',))
+
+    def __init__(self, base_url: str, pool_size: int = 16, timeout: Timeout = (3.05, 30.),
+                 retries: int = 3, backoff: float = 0.2, max_backoff: float = 2.):
+        """
+        :param base_url: mirai-api-http 的地址
+        :param pool_size: 连接池保持的连接数量，应不小于同时发出请求的线程数量
+        :param timeout: 默认超时时间，单位为秒，可以是 (连接超时, 读取超时)
+        :param retries: GET 请求的最大重试次数
+        :param backoff: 第一次重试前最长等待的秒数，之后每次翻倍
+        :param max_backoff: 重试前最长等待的秒数
+        """
+        self.base_url: str = base_url
+        self.pool_size: int = pool_size
+        self.timeout: Timeout = timeout
+        self.timeouts: Dict[str, Timeout] = dict(self.timeouts)
+        self.retries: int = retries
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+
+        self.__adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.__session = requests.Session()
+        self.__session.headers['Connection'] = 'keep-alive'
+        self.__session.mount('http://', self.__adapter)
+        self.__session.mount('https://', self.__adapter)
+        self.__lock = threading.Lock()
+        self.__counters: Dict[str, int] = {'requests': 0, 'retries': 0, 'errors': 0}
+
+    def get(self, endpoint: str, params: Optional[dict] = None, retry: Optional[bool] = None) -> dict:
+        """发送 GET 请求并返回解析后的 json
+        :param endpoint: 接口名，如 'friendList'
+        :param params: 查询参数
+        :param retry: 是否重试，默认除 fetchMessage 外都重试
+        """
+        retries = self.retries if (endpoint not in self.no_retry if retry is None else retry) else 0
+        for attempt in range(retries + 1):
+            try:
+                return self.__request('GET', endpoint, params=params)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+                with self.__lock:
+                    self.__counters['retries'] += 1
+                time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def post(self, endpoint: str, json=None, data=None, files=None, headers: Optional[dict] = None) -> dict:
+        """发送 POST 请求并返回解析后的 json，POST 请求不会重试
+        :param endpoint: 接口名，如 'sendGroupMessage'
+        """
+        return self.__request('POST', endpoint, json=json, data=data, files=files, headers=headers)
+
+    def stats(self) -> Dict[str, int]:
+        """请求计数；connections 为建立过的连接数量，pool_requests 为经由连接池发出的请求数量，
+        二者之差即复用连接的次数"""
+        with self.__lock:
+            stats = dict(self.__counters)
+        pools = self.__adapter.poolmanager.pools
+        connections = pool_requests = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+        stats.update(connections=connections, pool_requests=pool_requests,
+                     reused=max(0, pool_requests - connections))
+        return stats
+
+    def close(self):
+        self.__session.close()
+
+    def __request(self, method: str, endpoint: str, **kwargs) -> dict:
+        with self.__lock:
+            self.__counters['requests'] += 1
+        try:
+            response = self.__session.request(method, f'{self.base_url}/{endpoint}',
+                                              timeout=self.timeouts.get(endpoint, self.timeout), **kwargs)
+        except requests.RequestException:
+            with self.__lock:
+                self.__counters['errors'] += 1
+            raise
+        return response.json()
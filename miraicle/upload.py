@@ -0,0 +1,114 @@
+import asyncio
+import os
+import uuid
+from typing import Callable, Dict, Optional, Union, BinaryIO
+
+Progress = Callable[[int, int], None]
+
+
+class MultipartBody:
+    """multipart/form-data 请求体：若干文本字段加一个文件字段，
+    文件内容按块读取，请求体长度事先算出，不需要把文件读入内存"""
+
+    def __init__(self, fields: Dict[str, object], name: str, source: Union[str, BinaryIO],
+                 filename: Optional[str] = None, chunk_size: int = 64 * 1024, progress: Optional[Progress] = None):
+        """
+        :param fields: 文本字段
+        :param name: 文件字段名
+        :param source: 文件路径或以二进制模式打开的文件对象，文件对象由调用者关闭
+        :param filename: 上传的文件名，默认为文件路径的文件名
+        :param chunk_size: 每次读取的字节数
+        :param progress: 进度回调，参数为已发送的文件字节数与文件总字节数
+        """
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.boundary = uuid.uuid4().hex
+        self.sent = 0
+
+        if isinstance(source, str):
+            self._file = open(source, 'rb')
+            self._owns_file = True
+            filename = filename or os.path.basename(source)
+        else:
+            self._file = source
+            self._owns_file = False
+            filename = filename or os.path.basename(getattr(source, 'name', None) or name)
+        start = self._file.tell()
+        self.file_size = self._file.seek(0, os.SEEK_END) - start
+        self._file.seek(start)
+
+        head = ''.join(f'--{self.boundary}\r\n'
+                       f'Content-Disposition: form-data; name="{key}"\r\n\r\n'
+                       f'{value}\r\n'
+                       for key, value in fields.items() if value is not None)
+        head += (f'--{self.boundary}\r\n'
+                 f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n')
+        self._head = head.encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    def __len__(self) -> int:
+        return len(self._head) + self.file_size + len(self._tail)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {'Content-Type': f'multipart/form-data; boundary={self.boundary}',
+                'Content-Length': str(len(self))}
+
+    def close(self):
+        if self._owns_file and not self._file.closed:
+            self._file.close()
+
+    def _read_file(self, size: int) -> bytes:
+        chunk = self._file.read(min(size, self.file_size - self.sent))
+        self.sent += len(chunk)
+        if self.progress:
+            self.progress(self.sent, self.file_size)
+        return chunk
+
+
+class MultipartStream(MultipartBody):
+    """Mirai 使用的请求体，requests 通过 read 按块读取"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__stage = 0
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.chunk_size if size is None or size < 0 else size
+        if self.__stage == 0:
+            self.__stage = 1
+            return self._head
+        if self.__stage == 1:
+            chunk = self._read_file(size) if self.sent < self.file_size else b''
+            if chunk:
+                return chunk
+            self.__stage = 2
+            return self._tail
+        return b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncMultipartStream(MultipartBody):
+    """AsyncMirai 使用的请求体，文件在线程池中按块读取，不阻塞事件循环"""
+
+    async def __aiter__(self):
+        loop = asyncio.get_event_loop()
+        yield self._head
+        while self.sent < self.file_size:
+            chunk = await loop.run_in_executor(None, self._read_file, self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
@@ -1,14 +1,24 @@
+import asyncio
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
 import warnings
+from typing import Optional
+
+logger = logging.getLogger('miraicle')
 
 
 def start_log(func):
     def wrapper(*args, **kwargs):
         try:
-            print(color(f"method '{func.__name__}' starts", 'green'))
+            logger.info("method '%s' starts", func.__name__, extra={'color': 'green'})
             result = func(*args, **kwargs)
             return result
         except Exception as e:
-            print(color(f"method '{func.__name__}' raised an error: {e.__class__.__name__}", 'red'))
+            logger.error("method '%s' raised an error: %s", func.__name__, e.__class__.__name__)
             raise e
 
     return wrapper
@@ -18,10 +28,10 @@ def end_log(func):
     def wrapper(*args, **kwargs):
         try:
             result = func(*args, **kwargs)
-            print(color(f"method '{func.__name__}' has called", 'green'))
+            logger.info("method '%s' has called", func.__name__, extra={'color': 'green'})
             return result
         except Exception as e:
-            print(color(f"method '{func.__name__}' raised an error: {e.__class__.__name__}", 'red'))
+            logger.error("method '%s' raised an error: %s", func.__name__, e.__class__.__name__)
             raise e
 
     return wrapper
@@ -40,6 +50,114 @@ def color(string, to_color):
     return f'\033[0;{color_code}m{string}\033[0m'
 
 
+class ColorFormatter(logging.Formatter):
+    """终端日志格式：记录的 extra 中的 color 优先，否则按级别着色"""
+
+    level_colors = {logging.WARNING: 'yellow', logging.ERROR: 'red', logging.CRITICAL: 'red'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        to_color = getattr(record, 'color', None) or self.level_colors.get(record.levelno, None)
+        return color(text, to_color) if to_color else text
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON Lines 日志格式，每条记录一行"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': record.created,
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录原样放入队列，消息的格式化（包括消息对象的 __repr__）推迟到后台写入线程；
+    队列已满时丢弃记录，不阻塞调用者"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+__listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(level: int = logging.INFO, console: bool = True, json_file: Optional[str] = None,
+                  queue_size: int = 10000) -> LazyQueueHandler:
+    """配置 miraicle 的日志：调用线程只把记录放入队列，由后台线程格式化并写出；
+    配置后 miraicle 的日志不再传给根 logger，再次调用会关闭之前的 handler
+    :param level: 日志级别，低于该级别的记录在调用处直接被忽略
+    :param console: 是否输出到终端
+    :param json_file: JSON Lines 日志文件路径，为空时不写入文件
+    :param queue_size: 等待写出的记录数量上限，超过时丢弃新记录
+    :return: 放入 logger 的 handler，dropped 为被丢弃的记录数量
+    """
+    global __listener
+    shutdown_logging()
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(ColorFormatter())
+        handlers.append(console_handler)
+    if json_file:
+        file_handler = logging.FileHandler(json_file, encoding='utf-8')
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    queue_handler = LazyQueueHandler(queue.Queue(queue_size))
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    __listener = logging.handlers.QueueListener(queue_handler.queue, *handlers)
+    __listener.start()
+    return queue_handler
+
+
+def ensure_logging():
+    """应用没有为 miraicle 或根 logger 配置 handler 时使用默认配置，在 bot 开始运行时调用；
+    应用已经配置了日志时不做任何修改"""
+    if __listener is None and not logger.handlers and not logging.getLogger().handlers:
+        setup_logging()
+
+
+def flush_logging():
+    """等待队列中的日志全部写出，之后继续后台写入"""
+    if __listener is not None:
+        __listener.stop()
+        __listener.start()
+
+
+def shutdown_logging():
+    """写出队列中的日志后停止后台线程，关闭并移除 setup_logging 添加的 handler；在解释器退出时自动调用"""
+    global __listener
+    if __listener is None:
+        return
+    listener, __listener = __listener, None
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    for handler in list(logger.handlers):
+        if isinstance(handler, LazyQueueHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    logger.propagate = True
+
+
+atexit.register(shutdown_logging)
+
+
 class Singleton(type):
     __instances = {}
 
@@ -49,3 +167,47 @@ class Singleton(type):
         else:
             warnings.warn(f'不能为类 {cls.__name__} 创建两个实例')
         return cls.__instances[cls]
+
+
+def next_poll_interval(interval: float, fetched: int, count: int,
+                       idle_interval: float, min_interval: float = 0.01) -> float:
+    """根据上一次拉取到的消息数量计算下一次轮询前的等待时间
+    :param interval: 上一次的等待时间
+    :param fetched: 上一次拉取到的消息数量
+    :param count: 每次拉取的消息数量上限
+    :param idle_interval: 消息队列为空时等待时间的上限
+    :param min_interval: 等待时间的下限
+    :return: 下一次轮询前的等待时间，单位为秒
+    """
+    if fetched >= count:
+        return 0.
+    if fetched:
+        return min_interval
+    return min(max(interval * 2, min_interval), idle_interval)
+
+
+def resolve_key(key, msg):
+    """计算消息的顺序键
+    :param key: None、消息的属性名（如 'group'、'sender'）或以消息为参数的函数
+    :return: 顺序键，为 None 时表示不需要保证顺序；顺序键函数抛出异常时也返回 None
+    """
+    if key is None:
+        return None
+    if callable(key):
+        try:
+            return key(msg)
+        except Exception as e:
+            logger.error('计算顺序键失败，按无序方式处理: %s: %s', e.__class__.__name__, e)
+            return None
+    return getattr(msg, key, None)
+
+
+async def cancel_tasks(tasks):
+    """取消任务并等待它们结束，忽略正在运行的任务本身（如在处理函数中调用 close）
+    :param tasks: 要取消的任务
+    """
+    current = asyncio.current_task() if hasattr(asyncio, 'current_task') else asyncio.Task.current_task()
+    tasks = [task for task in tasks if task is not current and not task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)